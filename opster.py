@@ -2,21 +2,45 @@
 '''Command line arguments parser
 '''
 
-import sys, traceback, getopt, textwrap, inspect, os, re, keyword
-
-from functools import wraps
-from collections import namedtuple
-from collections.abc import Callable
-from contextlib import contextmanager
-
-
-__all__ = ['Dispatcher', 'command', 'dispatch']
+import sys, os, time
+
+# imports of opster itself are reported with OPSTER_IMPORTS as well (see
+# ``ImportRecorder``): modules loaded before them, time and traced memory
+if os.environ.get('OPSTER_IMPORTS'):
+    import tracemalloc
+    tracemalloc.start()
+    PRELOADED = (set(sys.modules), time.perf_counter(),
+                 tracemalloc.get_traced_memory()[0])
+else:
+    PRELOADED = None
+
+import traceback, getopt, textwrap, inspect, re, keyword
+import codecs, bisect, contextvars, io
+
+from functools import wraps, lru_cache
+from collections import namedtuple, OrderedDict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, nullcontext
+from enum import Enum
+from types import MappingProxyType
+
+
+__all__ = ['Dispatcher', 'command', 'dispatch', 'cached_completer', 'File',
+           'ResultCache', 'progress', 'opt']
 __version__ = '5.0'
 
 
 def write(text, out=None):
     '''Write output to a given stream (stdout by default).'''
     out = out or sys.stdout
+    if progress_bars:
+        # do not mix output with progress bars
+        with progress_lock:
+            for bar in progress_bars:
+                bar.clear()
+            print(text, file=out)
+            out.flush()
+        return
     print(text, file=out)
     # Get the order of stdout/stderr correct on Windows. AFAICT this is only
     # needed for the test environment but it's harmless otherwise.
@@ -28,27 +52,161 @@ def err(text):
     write(text, out=sys.stderr)
 
 
+def progress(iterable, total=None, label='', out=None, interval=None):
+    '''Iterate over ``iterable``, reporting progress to stderr.
+
+    Iteration itself only increments a counter, report is rendered by a
+    background thread: redrawn every ``interval`` seconds (0.1 by default) on
+    a terminal or written as a separate line (every 10 seconds by default)
+    otherwise. ``write`` and ``err`` clear progress line before printing.
+
+    - ``total``: number of items, taken from ``len(iterable)`` if possible
+    - ``label``: text to show before counters
+    '''
+    if total is None:
+        try:
+            total = len(iterable)
+        except TypeError:
+            pass
+    out = out or sys.stderr
+    if isinstance(out, StreamProxy):
+        # report is drawn by another thread, which has no current invocation
+        out = out.target()
+    bar = Progress(total, label, out, interval)
+    bar.start()
+    try:
+        for item in iterable:
+            bar.count += 1
+            yield item
+    finally:
+        bar.stop()
+
+
+# progress bars being shown now and lock for drawing them
+progress_bars = []
+progress_lock = None
+
+
+class Progress(object):
+    '''State of a progress report, see ``progress``.'''
+
+    def __init__(self, total, label, out, interval=None):
+        self.count = 0
+        self.total = total
+        self.label = label and label + ': '
+        self.out = out
+        self.tty = hasattr(out, 'isatty') and out.isatty()
+        self.interval = interval or (self.tty and 0.1 or 10)
+        self.started = time.time()
+        self.width = 0
+
+    def start(self):
+        global progress_lock
+        import threading
+        if progress_lock is None:
+            progress_lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        progress_bars.append(self)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.render()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.render()
+        with progress_lock:
+            progress_bars.remove(self)
+            if self.tty:
+                self.out.write('\n')
+                self.out.flush()
+
+    def line(self):
+        elapsed = time.time() - self.started
+        if self.total:
+            return '%s%d/%d (%d%%) %.1fs' % (
+                self.label, self.count, self.total,
+                self.count * 100 // self.total, elapsed)
+        return '%s%d %.1fs' % (self.label, self.count, elapsed)
+
+    def render(self):
+        with progress_lock:
+            line = self.line()
+            if self.tty:
+                self.out.write('\r' + line.ljust(self.width))
+                self.width = len(line)
+            else:
+                self.out.write(line + '\n')
+            self.out.flush()
+
+    def clear(self):
+        if self.tty and self.width:
+            self.out.write('\r%s\r' % (' ' * self.width))
+            self.width = 0
+
+
 # encoding to use when decoding command line arguments
 FSE_ENCODING = sys.getfilesystemencoding()
 ARG_ENCODING = os.environ.get('OPSTER_ARG_ENCODING', FSE_ENCODING)
 
 
-def decodearg(arg, arg_encoding=ARG_ENCODING):
-    '''Decode an argument from sys.argv'''
+@lru_cache()
+def argdecoder(arg_encoding):
+    '''Get function to decode arguments from sys.argv as ``arg_encoding``.
+
+    Returns None if arguments are already decoded properly.
+    '''
     # python 3.x: have unicode
     # arg has already been decoded with FSE_ENCODING
     # In the default case we just return the arg as it is
-    if arg_encoding == FSE_ENCODING:
-        return arg
+    if codecs.lookup(arg_encoding).name == codecs.lookup(FSE_ENCODING).name:
+        return None
 
     # Need to encode and redecode as arg_encoding
     if os.name == 'posix':
         # On posix the argument was decoded using surrogate escape
-        arg = arg.encode(FSE_ENCODING, 'surrogateescape')
+        errors = 'surrogateescape'
     else:
         # On windows the 'mbcs' codec has no surrogate escape handler
-        arg = arg.encode(FSE_ENCODING)
-    return arg.decode(arg_encoding)
+        errors = 'strict'
+    encode = codecs.getencoder(FSE_ENCODING)
+    decode = codecs.getdecoder(arg_encoding)
+    return lambda arg: decode(encode(arg, errors)[0])[0]
+
+
+def decodearg(arg, arg_encoding=ARG_ENCODING):
+    '''Decode an argument from sys.argv'''
+    decoder = argdecoder(arg_encoding)
+    if decoder is None:
+        return arg
+    return decoder(arg)
+
+
+# interval (in seconds of CPU time) between stack samples, see ``Sampler``
+SAMPLE_INTERVAL = float(os.environ.get('OPSTER_SAMPLE_INTERVAL', 0.01))
+
+
+def sampled(func):
+    '''Decorator sampling stacks of a call if ``OPSTER_SAMPLE`` is set.
+
+    Samples are written to a file named by ``OPSTER_SAMPLE``. Does nothing
+    on platforms without ``setitimer`` or when sampling is already active.
+    '''
+    @wraps(func)
+    def inner(*args, **kwargs):
+        path = os.environ.get('OPSTER_SAMPLE')
+        if not path or Sampler.active:
+            return func(*args, **kwargs)
+        import signal
+        if not hasattr(signal, 'setitimer'):
+            return func(*args, **kwargs)
+        with Sampler(path, SAMPLE_INTERVAL):
+            return func(*args, **kwargs)
+    return inner
 
 
 class Dispatcher(object):
@@ -58,27 +216,206 @@ class Dispatcher(object):
       decorated with ``Dispatcher.command``.
     - ``globaloptions``: list of options which are applied to all
       commands, will contain ``--help`` option at least.
-    - ``middleware``: global decorator for all commands.
+    - ``middleware``: global decorator for all commands, or a list of them
+      (see ``Dispatcher.use``).
+    - ``bytes_args``: pass positional arguments to commands as ``bytes``
+      (exactly as they were given to the program) instead of ``str``.
+    - ``chain``: separator of chained commands, e.g. ``'+'`` makes it possible
+      to run ``prog list + filter -x + export``. Every command after the first
+      gets result of the previous one as the first argument, so generators
+      are consumed lazily, one item at a time.
+    - ``formats``: add ``--format`` global option to choose how results of
+      commands returning iterators are written (text, jsonl or csv).
+    - ``watch``: add ``--watch`` global option to keep running command again
+      every time its input files change.
+
+    Resources shared by commands are registered with ``Dispatcher.resource``.
     '''
 
-    def __init__(self, cmdtable=None, globaloptions=None, middleware=None):
+    def __init__(self, cmdtable=None, globaloptions=None, middleware=None,
+                 bytes_args=False, chain=None, formats=False, watch=False):
         self._cmdtable = CmdTable(cmdtable or {})
         self._globaloptions = [Option(o) for o in (globaloptions or [])]
+        self._middlewares = []
+        self._composed = {}
+        self._index = None
+        self._resources = {}
+        self._pool = {}
+        self._finalizers = []
+        self._lock = None
+        self._checked = None
+        self._parsed = None
+        self._search = None
+        self._jobs = []
         self.middleware = middleware
+        self.bytes_args = bytes_args
+        self.chain = chain
+        self.formats = formats
+        self.watch = watch
 
     @property
     def globaloptions(self):
         opts = self._globaloptions[:]
         if not any(o.name == 'help' for o in opts):
             opts.append(Option(('h', 'help', False, 'display help')))
+        if self.formats and not any(o.name == 'format' for o in opts):
+            opts.append(FORMAT_OPTION)
+        if self.watch and not any(o.name == 'watch' for o in opts):
+            opts.append(WATCH_OPTION)
         return opts
 
     @property
     def cmdtable(self):
         return self._cmdtable.copy()
 
+    @property
+    def middleware(self):
+        '''Decorator applying all unscoped middlewares, None if there are none.
+        '''
+        if not self._middlewares:
+            return None
+        return lambda func: self.compose(func)[0]
+
+    @middleware.setter
+    def middleware(self, middleware):
+        self._middlewares = []
+        self._composed.clear()
+        if isinstance(middleware, (list, tuple)):
+            for mw in middleware:
+                self.use(mw)
+        elif middleware:
+            self.use(middleware)
+
+    def use(self, middleware, commands=None):
+        '''Add middleware to the end of the stack, wrapping every command.
+
+        Middleware is either a decorator or an object with some of methods:
+
+         - ``before(name, args, kwargs)``: called before command, can modify
+           ``kwargs``
+         - ``after(name, result)``: called after command, returns result
+         - ``error(name, exc)``: called when command raises an exception,
+           which is propagated after that
+
+        First middleware in the stack is the outermost one. ``commands`` limits
+        middleware to commands with given names; if one of them is a nested
+        dispatcher, middleware is applied to all of its commands.
+        '''
+        self._middlewares.append((middleware, commands and set(commands)))
+        self._composed.clear()
+        return middleware
+
+    def resource(self, name):
+        '''Decorator registering a factory of resource ``name``.
+
+        Commands get a resource by having a parameter with its name (better
+        keyword-only, so that it is not taken for a positional argument)::
+
+          @d.resource('db')
+          def db():
+              conn = connect()
+              yield conn
+              conn.close()
+
+          @d.command()
+          def query(sql, *, db):
+              ...
+
+        Factory is called only when a command needing the resource is run for
+        the first time, after that the same value is given to every command
+        in this process. If factory is a generator, value it yields is used and
+        the rest of it is run on exit, resources created later are torn down
+        first.
+
+        Every resource is created once even when commands are run in parallel
+        threads (see ``invoke``), but then the same value is used by all of
+        them at once, so it should be thread-safe.
+        '''
+        def decorator(factory):
+            if self._lock is None:
+                import threading
+                self._lock = threading.RLock()
+            self._resources[name] = factory
+            return factory
+        return decorator
+
+    def acquire(self, name):
+        '''Value of resource ``name``, created on first use.'''
+        if name in self._pool:
+            return self._pool[name]
+        with self._lock:
+            if name in self._pool:  # created by another thread meanwhile
+                return self._pool[name]
+            factory = self._resources[name]
+            if inspect.isgeneratorfunction(factory):
+                manager = contextmanager(factory)()
+                value = manager.__enter__()
+                self._finalizers.append(
+                    lambda: manager.__exit__(None, None, None))
+            else:
+                value = factory()
+            if not self._pool:
+                import atexit
+                atexit.register(self.release)
+            self._pool[name] = value
+            return value
+
+    def release(self):
+        '''Tear down all created resources, in reverse order of creation.'''
+        import atexit
+        atexit.unregister(self.release)
+        if self._lock is None:
+            return
+        with self._lock:
+            self._pool.clear()
+            while self._finalizers:
+                self._finalizers.pop()()
+
+    def inject(self, func, opts):
+        '''Add resources wanted by ``func`` to keyword arguments ``opts``.'''
+        if not self._resources:
+            return opts
+        names = [name for name in parameter_names(func)
+                 if name in self._resources and name not in opts]
+        if not names:
+            return opts
+        return dict(opts, **dict((name, self.acquire(name))
+                                 for name in names))
+
+    def scoped(self, cmd):
+        '''Middlewares applied to a command.'''
+        return tuple(mw for mw, commands in self._middlewares
+                     if commands is None or cmd in commands)
+
+    def compose(self, func, cmd=None, outer=()):
+        '''Wrap function with middlewares of a command.
+
+        Returns wrapped function and number of wrappers. Result is cached for
+        every command, so stack is composed only once.
+        '''
+        if not self._middlewares and not outer:
+            return func, 0
+        cached = self._composed.get(cmd)
+        if cached and cached[0] is func and cached[1] == outer:
+            return cached[2]
+
+        if cmd is None:
+            stack = outer + tuple(mw for mw, commands in self._middlewares
+                                  if commands is None)
+        else:
+            stack = outer + self.scoped(cmd)
+        wrapped = func
+        for mw in reversed(stack):
+            if any(hasattr(mw, hook) for hook in ('before', 'after', 'error')):
+                mw = hooks_middleware(mw, cmd)
+            wrapped = mw(wrapped)
+        if cmd is not None:
+            self._composed[cmd] = func, outer, (wrapped, len(stack))
+        return wrapped, len(stack)
+
     def command(self, options=None, usage=None, name=None, shortlist=False,
-                hide=False, aliases=()):
+                hide=False, aliases=(), bytes_args=None, cache=None,
+                watch=None):
         '''Decorator to mark function to be used as command for CLI.
 
         Usage::
@@ -112,6 +449,12 @@ class Dispatcher(object):
          - ``hide``: if command should be hidden from help listing. Used only
            with multiple subcommands, overrides ``shortlist``
          - ``aliases``: list of aliases for command
+         - ``bytes_args``: pass positional arguments as ``bytes``, overrides
+           ``bytes_args`` of the dispatcher
+         - ``cache``: ``True`` or ``ResultCache`` instance to reuse output of a
+           command which was already called with the same arguments
+         - ``watch``: list of files and directories to watch when the command
+           is called with ``--watch`` (see ``Dispatcher``)
 
         If defined, options should be a list of 4-tuples in format::
 
@@ -127,6 +470,12 @@ class Dispatcher(object):
          - ``default`` value for an option, type of it determines how option
            will be processed
          - ``help`` string displayed as a help for an option when asked to
+
+        Options with ``str`` defaults are always decoded (see
+        ``OPSTER_ARG_ENCODING``), use ``bytes`` defaults to get raw values.
+
+        Type of an option can be given by an annotation instead of default
+        value, see ``opt``.
         '''
         def wrapper(func):
             try:
@@ -150,27 +499,43 @@ class Dispatcher(object):
                 scriptname = scriptname or sysname()
                 return help_cmd(func, usage_, options_, aliases, scriptname)
 
+            @sampled
             def command(argv=None, scriptname=None):
                 scriptname = scriptname or sysname()
                 merge_globalopts(self.globaloptions, options_)
 
                 if argv is None:
                     argv = sys.argv[1:]
+                as_bytes = self.bytes_args if bytes_args is None else bytes_args
 
                 try:
                     with exchandle(func.help, scriptname):
-                        args, opts = process(argv, options_)
+                        args, opts = process(argv, options_, as_bytes)
 
                     if opts.pop('help', False):
                         return func.help(scriptname)
+                    fmt = pop_reserved(opts, options_, FORMAT_OPTION, 'text')
 
                     with exchandle(func.help, scriptname):
-                        with help_workaround(func, scriptname):
-                            return call_cmd(scriptname, func, options_)(*args, **opts)
+                        with help_workaround(func, scriptname), closing_files():
+                            def run():
+                                result = call_cmd(scriptname, func, options_)(
+                                    *args, **self.inject(func, opts))
+                                return output(result, fmt)
+                            if cache_:
+                                return cache_.call(func, args, opts, fmt, run)
+                            return run()
 
                 except ErrorHandled:
                     return -1
 
+            if bytes_args is not None:
+                func.bytes_args = bytes_args
+            cache_ = cache is True and ResultCache() or cache
+            if cache_:
+                func.cache = cache_
+            if watch:
+                func.watch = watch
             func.usage = usage_
             func.help = help_func
             func.command = command
@@ -195,6 +560,34 @@ class Dispatcher(object):
         prefix = hide and '~' or (shortlist and '^' or '')
         self._cmdtable[prefix + name] = dispatcher, [], None
 
+    def register_many(self, commands):
+        '''Add many commands at once, introspecting them only when used.
+
+        ``commands`` is a dict (or a list of pairs) with keys like in
+        ``cmdtable`` (``^`` and ``~`` prefixes and ``|`` separated aliases
+        are allowed) and either functions or ``(func, options, usage)``
+        tuples as values. Options and usage are determined (and options
+        checked) only when a command is run, completed or shown in help, so
+        generated commands which are not used cost only a small record each.
+
+        Raises ``OpsterError`` and adds nothing if some name is already taken.
+        '''
+        if hasattr(commands, 'items'):
+            commands = commands.items()
+        taken = set(alias for key in self._cmdtable for alias in aliases_(key))
+        entries = {}
+        for key, entry in commands:
+            for alias in aliases_(key):
+                if alias in taken:
+                    raise OpsterError('Command %s is already defined' % alias)
+                taken.add(alias)
+            if isinstance(entry, tuple):
+                entries[key] = CommandEntry(*entry)
+            else:
+                entries[key] = CommandEntry(entry)
+        self._cmdtable.update(entries)
+
+    @sampled
     def dispatch(self, args=None, scriptname=None):
         '''Dispatch command line arguments using subcommands.
 
@@ -204,48 +597,469 @@ class Dispatcher(object):
             args = sys.argv[1:]
         scriptname = scriptname or sysname()
 
-        # Add help function to the table
-        cmdtable = self.cmdtable
-        help_func = help_(cmdtable, self.globaloptions, scriptname)
-        cmdtable['help'] = help_func, [], '[TOPIC]'
+        try:
+            return self._dispatch_chain(args, scriptname)
+        except ErrorHandled:
+            return -1
+
+    def invoke(self, args, stdin=None, env=None, scriptname=None,
+               spool_size=1024 * 1024):
+        '''Run a command line in this process, capturing its output.
+
+        Returns ``Invocation`` with:
+
+         - ``code``: exit status, like with ``sys.exit(dispatch(args))``
+         - ``stdout`` and ``stderr``: output as bytes
+         - ``command``, ``args`` and ``options``: command (the last one of a
+           chain) and its arguments and options parsed from command line
+         - ``result``: value returned by command
+         - ``exception``: error handled by opster (after printing its
+           message) or raised by command (its traceback is in ``stderr``)
+
+        ``sys.stdin``, ``sys.stdout`` and ``sys.stderr`` are replaced by
+        proxies to streams of current invocation, so that invocations can run
+        in parallel threads. Output is kept in memory up to ``spool_size``
+        bytes per stream and in a temporary file after that. ``stdin`` is
+        bytes, text or a file object; ``env`` updates ``os.environ`` during
+        the call (note that environment is shared by all threads).
+
+        Output of threads started by a command is not captured (except for
+        ``progress``), unless they are run with ``contextvars.copy_context``.
+        '''
+        install_stream_proxies()
+        if stdin is None or isinstance(stdin, (bytes, str)):
+            data = stdin or b''
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            stdin = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+        streams = (stdin,) + tuple(
+            io.TextIOWrapper(SpooledOutput(spool_size), encoding='utf-8',
+                             errors=errors, write_through=True)
+            for errors in ('strict', 'backslashreplace'))
+        state = InvocationState(streams)
+        token = current_invocation.set(state)
+        result = exception = None
+        try:
+            with environment(env):
+                result = self._dispatch_chain(args, scriptname or sysname())
+            code = exit_status(result if isinstance(result, int) else None)
+        except ErrorHandled as e:
+            code, exception = 255, e.__cause__
+        except SystemExit as e:
+            code = exit_status(e.code)
+        except Exception as e:
+            traceback.print_exc()
+            code, exception = 1, e
+        finally:
+            current_invocation.reset(token)
+        stdout, stderr = [stream.detach().getvalue() for stream in streams[1:]]
+        parsed = state.parsed
+        return Invocation(code, stdout, stderr, parsed.get('command'),
+                          parsed.get('args'), parsed.get('options'), result,
+                          exception)
+
+    def _dispatch_chain(self, args, scriptname):
+        # every command in a chain gets result of a previous one as its
+        # first argument
+        upstream = ()
+        stages = chain_stages(args, self.chain)
+        with closing_files():
+            for i, stage in enumerate(stages, 1):
+                upstream = (self._dispatch(stage, scriptname, upstream,
+                                           last=i == len(stages)),)
+        return upstream[0]
+
+    def load_plugins(self, group):
+        '''Add commands from entry points of a given group.
+
+        Entry point can refer to a function (decorated with ``command`` or
+        not) or to a ``Dispatcher``, which is then nested under entry point
+        name. Plugins are imported only when they are executed: their names
+        and help are kept in an index in opster's cache directory, which is
+        rebuilt when installed packages change.
+        '''
+        for plugin in plugin_index(group):
+            self._cmdtable[plugin['name']] = (
+                LazyCommand(plugin['value'], plugin['doc']), [], None)
+
+    def completion_index(self):
+        '''Index of commands and options used for completion.
+
+        It is built once and rebuilt only when commands are added.
+        '''
+        key = id(self._cmdtable), len(self._cmdtable), len(self._globaloptions)
+        if self._index is None or self._index[0] != key:
+            cmdtable = self.cmdtable
+            cmdtable['help'] = None, HELP_OPTIONS, '[OPTIONS] [TOPIC]'
+            cmdtable['~_shell'] = None, [], '%name'
+            self._index = key, CompletionIndex(cmdtable, self.globaloptions)
+        return self._index[1]
+
+    def search_index(self):
+        '''Index of words in commands and their help, used by ``help -k``.
+
+        It is kept in opster's cache directory and rebuilt when commands,
+        their docstrings or files defining them change.
+        '''
+        key = id(self._cmdtable), len(self._cmdtable), len(self._globaloptions)
+        if self._search is None or self._search[0] != key:
+            self._search = key, SearchIndex.load(self._cmdtable)
+        return self._search[1]
+
+    def shell(self, prompt=None, scriptname=None):
+        '''Run interactive shell, dispatching each entered line as a command.
+
+        Commands and options are completed with TAB key (if ``readline`` is
+        available). Shell is also available as ``_shell`` command.
+        '''
+        import shlex
+        scriptname = scriptname or sysname()
+        interactive = sys.stdin.isatty()
+        if prompt is None:
+            prompt = interactive and '%s> ' % scriptname or ''
+        if interactive:
+            self.setup_readline(scriptname)
 
-        autocomplete(cmdtable, args, self.middleware)
+        while True:
+            try:
+                line = input(prompt)
+            except EOFError:
+                if interactive:
+                    write('')
+                return
+            except KeyboardInterrupt:
+                write('')
+                continue
 
+            try:
+                argv = shlex.split(line)
+            except ValueError as e:
+                err('error: %s' % e)
+                continue
+            if not argv:
+                continue
+            try:
+                self.dispatch(argv, scriptname)
+            except SystemExit:
+                pass
+            except KeyboardInterrupt:
+                write('')
+            except Exception:
+                traceback.print_exc()
+
+    def setup_readline(self, scriptname):
+        '''Setup completion of commands in interactive shell.'''
         try:
-            with exchandle(help_func):
-                cmd, func, args, options = cmdparse(args, cmdtable,
-                                                    self.globaloptions)
+            import readline
+        except ImportError:
+            return
+        index = self.completion_index()
+        matches = []
+
+        def complete(text, state):
+            if not state:
+                line = readline.get_line_buffer()[:readline.get_begidx()]
+                cwords = line.split() + [text]
+                matches[:] = completions(index, cwords, len(cwords),
+                                         self.middleware)
+            try:
+                return matches[state] + ' '
+            except IndexError:
+                return None
+
+        readline.set_completer_delims(' \t\n')
+        readline.set_completer(complete)
+        readline.parse_and_bind('tab: complete')
+
+    def check(self, files, scriptname=None):
+        '''Validate command lines from files and report errors.
 
+        Every line is a command line as it would be typed in shell, ``#``
+        starts a comment. If program name is on a line (like in crontab), only
+        words after it are checked. ``-`` stands for stdin. Returns 1 if any
+        errors were found.
+        '''
+        import shlex
+        scriptname = scriptname or sysname()
+        lines, argvs, reports = [], [], []
+        for fname in files:
+            with (nullcontext(sys.stdin) if fname == '-' else
+                  open(fname)) as f:
+                for lineno, line in enumerate(f, 1):
+                    try:
+                        argv = shlex.split(line, comments=True)
+                    except ValueError as e:
+                        reports.append(((len(lines), lineno), fname, str(e)))
+                        continue
+                    argv = strip_program(argv, scriptname)
+                    if argv:
+                        lines.append((fname, lineno))
+                        argvs.append(argv)
+        for error in self.validate(argvs):
+            fname, lineno = lines[error['index']]
+            reports.append(((error['index'], lineno), fname, error['message']))
+        for key, fname, message in sorted(reports):
+            write('%s:%d: %s' % (fname, key[1], message))
+        return reports and 1 or None
+
+    def schedule(self, spec, argv, concurrency=1, jitter=0, name=None):
+        '''Run a command line on a schedule, in ``_scheduler`` command.
+
+        ``spec`` is a schedule in crontab format (``minute hour day month
+        weekday``, like ``*/5 * * * *``, or ``@hourly``, ``@daily`` and so
+        on), ``argv`` is a list of arguments or a string. When a command is
+        due while ``concurrency`` of its runs are still going, this run is
+        skipped. ``jitter`` delays runs by random number of seconds up to it,
+        so that commands due at the same time do not start at once.
+        '''
+        if isinstance(argv, str):
+            argv = split_command(argv)
+        self._jobs.append(Job(CronSpec(spec), list(argv), concurrency, jitter,
+                              name))
+
+    def run_scheduler(self, files=(), workers=4, once=False, log='-',
+                      scriptname=None):
+        '''Run scheduled commands in this process until interrupted.
+
+        Commands are scheduled with ``schedule`` or given in crontab
+        ``files`` (with program name in command lines, like in ``check``),
+        and are run by a pool of ``workers`` threads with
+        ``Dispatcher.invoke``. Every run is recorded in ``log`` file as a
+        JSON line with its schedule, start time, duration, exit code and
+        output. With ``once``, only commands due in current minute are run.
+        '''
+        scriptname = scriptname or sysname()
+        jobs = list(self._jobs)
+        for fname in files:
+            jobs.extend(crontab_jobs(fname, scriptname))
+        if not jobs:
+            raise OpsterError('no commands are scheduled')
+        errors = self.validate([job.argv for job in jobs])
+        for error in errors:
+            err('%s: %s' % (jobs[error['index']].name, error['message']))
+        if errors:
+            return 1
+        with (nullcontext(sys.stdout) if log == '-' else
+              open(log, 'a')) as f:
+            Scheduler(self, jobs, workers, f).run(once)
+
+    def validate(self, argvs):
+        '''Check command lines without running commands (or middlewares).
+
+        Commands are looked up and their options parsed and converted,
+        like when they are dispatched. Returns list of errors, which are dicts
+        with ``index`` of a command line in ``argvs``, ``argv`` itself,
+        ``command`` (``None`` if it was not found), ``error`` (``'unknown'``,
+        ``'ambiguous'``, ``'options'`` or ``'arguments'``) and ``message``.
+
+        Positional arguments are checked only for commands without
+        middlewares, since middlewares can supply arguments themselves.
+        '''
+        errors = []
+        cmdtable, globalopts = self._checktable()
+        for i, argv in enumerate(argvs):
+            stages = chain_stages(argv, self.chain)
+            for j, stage in enumerate(stages):
+                error = self._validate(stage, cmdtable, globalopts, j > 0)
+                if error:
+                    error.update(index=i, argv=argv)
+                    errors.append(error)
+                    break
+        return errors
+
+    def _checktable(self):
+        # command table with help and global options, built once for all
+        # validated lines
+        key = id(self._cmdtable), len(self._cmdtable), len(self._globaloptions)
+        if not self._checked or self._checked[0] != key:
+            cmdtable = self.cmdtable
+            cmdtable['help'] = None, HELP_OPTIONS, '[OPTIONS] [TOPIC]'
+            self._checked = key, (cmdtable, self.globaloptions)
+        return self._checked[1]
+
+    def parse_string(self, line):
+        '''Parse a command line given as a string, without running it.
+
+        Returns ``ParsedCommand`` with ``command`` name (with names of nested
+        dispatchers, separated by spaces), its positional ``args``, read-only
+        mapping of ``options`` (values of list options are tuples) and
+        ``argv``. Raises ``UnknownCommand``, ``AmbiguousCommand`` or
+        ``getopt.GetoptError`` if line is not valid.
+
+        Line is split like by ``shlex.split``. Results are kept in an LRU
+        cache, keyed by line and by its words, except for commands with
+        options converted by functions or file options, which are parsed
+        every time.
+        '''
+        key = id(self._cmdtable), len(self._cmdtable), len(self._globaloptions)
+        if not self._parsed or self._parsed[0] != key:
+            self._parsed = key, LRU(PARSE_CACHE_SIZE)
+        cache = self._parsed[1]
+        parsed = cache.get(line)
+        if parsed is not None:
+            return parsed
+        argv = tuple(split_command(line))
+        parsed = cache.get(argv)
+        if parsed is None:
+            cmd, args, opts, options = self._parse(argv, *self._checktable())
+            parsed = ParsedCommand(cmd, tuple(args), frozen(opts), argv)
+            if not all(o.reusable for o in options):
+                return parsed
+            cache[argv] = parsed
+        cache[line] = parsed
+        return parsed
+
+    def _parse(self, args, cmdtable, globalopts):
+        cmd, func, args, options = cmdparse(args, cmdtable, globalopts)
+        if isinstance(func, Dispatcher):
+            name, args, opts, options = func._parse(args, *func._checktable())
+            return cmd + (name and ' ' + name or ''), args, opts, options
+        as_bytes = getattr(func, 'bytes_args', self.bytes_args)
+        args, opts = process(args, options, as_bytes)
+        return cmd, args, opts, options
+
+    def _validate(self, args, cmdtable, globalopts, upstream=False,
+                  wrapped=False):
+        cmd = None
+        try:
+            cmd, func, args, options = cmdparse(args, cmdtable, globalopts)
             if isinstance(func, Dispatcher):
-                return func.dispatch(args, scriptname=scriptname + ' ' + cmd)
+                error = func._validate(args, *func._checktable(),
+                                       upstream=upstream,
+                                       wrapped=wrapped or
+                                       bool(self.scoped(cmd)))
+                if error and error['command']:
+                    error['command'] = cmd + ' ' + error['command']
+                return error
+            args, opts = process(args, options)
+            if not func or opts.pop('help', False):
+                return None
+            if not wrapped and not self.scoped(cmd):
+                pop_reserved(opts, options, FORMAT_OPTION)
+                pop_reserved(opts, options, WATCH_OPTION)
+                names = [name for name in parameter_names(func)
+                         if name in self._resources and name not in opts]
+                opts.update((name, None) for name in names)
+                signature(func).bind(*([None] * upstream + args), **opts)
+        except UnknownCommand as e:
+            return dict(command=None, error='unknown',
+                        message="unknown command: '%s'" % e)
+        except AmbiguousCommand as e:
+            return dict(command=None, error='ambiguous',
+                        message="command '%s' is ambiguous: %s" %
+                        (e.args[0], ' '.join(e.args[1])))
+        except (getopt.GetoptError, OpsterError) as e:
+            return dict(command=cmd, error='options', message=str(e))
+        except TypeError as e:
+            return dict(command=cmd, error='arguments',
+                        message='invalid arguments: %s' % e)
+
+    def _dispatch(self, args, scriptname, upstream=(), last=True, outer=()):
+        # Add help function to the table
+        cmdtable = self.cmdtable
+        help_func = help_(cmdtable, self.globaloptions, scriptname,
+                          self.search_index)
+        cmdtable['help'] = help_func, HELP_OPTIONS, '[OPTIONS] [TOPIC]'
 
-            with exchandle(help_func, cmd):
-                args, opts = process(args, options)
+        def shell(**opts):
+            '''Run interactive shell to execute commands.'''
+            return self.shell(scriptname=scriptname)
+        cmdtable['~_shell'] = shell, [], '%name'
 
-            if not cmd:
-                cmd, func, args, opts = ('help', help_func, ['shortlist'], {})
-            if opts.pop('help', False):
-                cmd, func, args, opts = ('help', help_func, [cmd], {})
+        def check(*files, **opts):
+            '''Check command lines from files (or stdin) without running them.
+            '''
+            return self.check(files or ['-'], scriptname)
+        cmdtable['~_check'] = check, [], '%name [FILE]...'
+
+        def scheduler(*files, workers=4, once=False, log='-', **opts):
+            '''Run scheduled commands (and those from crontab files).'''
+            return self.run_scheduler(files, workers, once, log, scriptname)
+        cmdtable['~_scheduler'] = (scheduler, SCHEDULER_OPTIONS,
+                                   '%name [OPTIONS] [CRONTAB]...')
+
+        def imports(**opts):
+            '''Report commands which are imported on every start.'''
+            recorder = ImportRecorder.active
+            if not recorder:
+                import subprocess
+                return subprocess.call(
+                    [sys.executable] + sys.argv[:1] + ['_imports'],
+                    env=dict(os.environ, OPSTER_IMPORTS='-'))
+            import atexit
+            atexit.unregister(recorder.report)
+            recorder.leaks(self.cmdtable)
+        cmdtable['~_imports'] = imports, [], '%name'
+
+        if 'OPSTER_AUTO_COMPLETE' in os.environ:
+            autocomplete(self.completion_index(), self.middleware)
+
+        with exchandle(help_func):
+            cmd, func, args, options = cmdparse(args, cmdtable,
+                                                self.globaloptions)
+
+        if isinstance(func, Dispatcher):
+            outer = outer + tuple(mw for mw, commands in self._middlewares
+                                  if commands and cmd in commands)
+            return func._dispatch(args, scriptname + ' ' + cmd, upstream, last,
+                                  outer)
+
+        as_bytes = getattr(func, 'bytes_args', self.bytes_args)
+        with exchandle(help_func, cmd):
+            args, opts = process(args, options, as_bytes)
+
+        if not cmd:
+            cmd, func, args, opts = ('help', help_func, ['shortlist'], {})
+        if opts.pop('help', False):
+            cmd, func, args, opts = ('help', help_func, [cmd], {})
+        if func is not help_func:
+            args = list(upstream) + args
+        fmt = pop_reserved(opts, options, FORMAT_OPTION, 'text')
+        watching = pop_reserved(opts, options, WATCH_OPTION)
+        invocation = current_invocation.get()
+        if invocation:
+            invocation.parsed.update(command=cmd, args=args, options=opts)
+
+        if cmd in ('_completion', '_shell', '_check', '_imports',
+                   '_scheduler'):
+            wrapped = func, 0
+        else:
+            wrapped = self.compose(func, cmd, outer)
+        # results of chained commands depend on their input
+        cache = last and not upstream and getattr(func, 'cache', None)
 
-            mw = cmd != '_completion' and self.middleware or None
+        def run():
+            result = call_cmd(cmd, func, options, wrapped=wrapped)(
+                *args, **self.inject(func, opts))
+            # intermediate results of a chain are consumed by next command
+            return output(result, fmt) if last else result
+
+        def execute():
             with exchandle(help_func, cmd):
-                with help_workaround(func, cmd, help_func):
-                    return call_cmd(cmd, func, options, mw)(*args, **opts)
+                with help_workaround(func, cmd, help_func), closing_files():
+                    if cache:
+                        return cache.call(func, args, opts, fmt, run)
+                    return run()
 
-        except ErrorHandled:
-            return -1
+        if watching and func is not help_func:
+            paths, outputs = watched_paths(func, opts)
+            if paths:
+                return watch(paths, execute, cmd, ignore=outputs)
+            err('%s has no files to watch, running it once' % cmd)
+        return execute()
 
 
 _dispatcher = None
 
 
 def command(options=None, usage=None, name=None, shortlist=False, hide=False,
-            aliases=()):
+            aliases=(), bytes_args=None, cache=None, watch=None):
     global _dispatcher
     if not _dispatcher:
         _dispatcher = Dispatcher()
     return _dispatcher.command(options=options, usage=usage, name=name,
-                               shortlist=shortlist, hide=hide, aliases=aliases)
+                               shortlist=shortlist, hide=hide, aliases=aliases,
+                               bytes_args=bytes_args, cache=cache, watch=watch)
 command.__doc__ = Dispatcher.command.__doc__
 
 
@@ -265,12 +1079,36 @@ def dispatch(args=None, cmdtable=None, globaloptions=None, middleware=None,
 dispatch.__doc__ = Dispatcher.dispatch.__doc__
 
 
+def opt(short, default, help='', completer=None):
+    '''Declare an option in a function signature::
+
+      @command()
+      def serve(port: int = opt('p', 8000, 'port to listen on'),
+                ids: list[int] = opt('i', [], 'ids to serve'),
+                mode: Literal['fast', 'safe'] = opt('m', 'fast', 'mode')):
+          pass
+
+    Values are converted to type from annotation: ``list[X]`` makes an
+    option which can be repeated, ``Literal`` and ``Enum`` types limit
+    possible values (enum members are given by name), any other type is
+    called with the value. ``dict``, ``tuple``, ``File`` and ``Callable``
+    annotations leave the type of an option to its default value.
+    '''
+    return Declaration((short, default, help, completer))
+
+
+class Declaration(tuple):
+    '''Option tuple declared with ``opt()``, which is typed by annotation'''
+
+
 # --------
 # Help
 # --------
 
-def help_(cmdtable, globalopts, scriptname):
+def help_(cmdtable, globalopts, scriptname, search_index=None):
     '''Help generator for a command table.
+
+    ``search_index`` is a function returning ``SearchIndex`` of commands.
     '''
     def help_inner(name=None, *args, **opts):
         '''Show help for a given help topic or a help overview.
@@ -278,6 +1116,8 @@ def help_(cmdtable, globalopts, scriptname):
         With no arguments, print a list of commands with short help messages.
 
         Given a command name, print help for that command.
+
+        With -k, list commands which have a word in their names or help.
         '''
         def helplist():
             hlp = {}
@@ -306,13 +1146,17 @@ def help_(cmdtable, globalopts, scriptname):
         if not cmdtable:
             return err('No commands specified!')
 
+        if opts.get('keyword') and search_index:
+            return help_search(search_index(), opts['keyword'])
+
         if not name or name == 'shortlist':
             return helplist()
 
         aliases, (cmd, options, usage) = findcmd(name, cmdtable)
 
         if isinstance(cmd, Dispatcher):
-            recurse = help_(cmd.cmdtable, globalopts, scriptname + ' ' + name)
+            recurse = help_(cmd.cmdtable, globalopts, scriptname + ' ' + name,
+                            cmd.search_index)
             return recurse(*args, **opts)
 
         options = list(options)
@@ -324,6 +1168,122 @@ def help_(cmdtable, globalopts, scriptname):
     return help_inner
 
 
+def help_search(index, keyword):
+    '''Show commands matching all words of a keyword.'''
+    found = index.search(keyword)
+    if not found:
+        return err("no commands matching '%s'" % keyword)
+    maxlen = max(len(name) for name, summary in found)
+    write("commands matching '%s':\n" % keyword)
+    for name, summary in found:
+        write(' %-*s  %s' % (maxlen, name, summary))
+
+
+class SearchIndex(object):
+    '''Inverted index of words in names, aliases, help and options of
+    commands, see ``help -k``.
+
+    Commands of nested dispatchers are included. Plugins are indexed only by
+    their names and help, so that they are not imported.
+    '''
+
+    def __init__(self, commands, words):
+        self.commands = commands
+        self.words = words
+        self.vocabulary = sorted(words)
+
+    @classmethod
+    def load(cls, cmdtable):
+        '''Index from cache, or built and cached if it's outdated.'''
+        import json, hashlib
+        name = hashlib.sha1(repr(sorted(cmdtable)).encode()).hexdigest()
+        path = cachedir('help', name + '.json')
+        fingerprint = cls.fingerprint(cmdtable)
+        try:
+            with open(path) as f:
+                index = json.load(f)
+            if index['fingerprint'] == fingerprint:
+                return cls(index['commands'], index['words'])
+        except (IOError, ValueError, KeyError):
+            pass
+
+        index = cls.build(cmdtable)
+        try:
+            atomic_write(path, json.dumps({'fingerprint': fingerprint,
+                                           'commands': index.commands,
+                                           'words': index.words}))
+        except (IOError, OSError):
+            pass  # read-only cache is not a reason to fail
+        return index
+
+    @staticmethod
+    def fingerprint(cmdtable):
+        '''Hash of commands, their docstrings and files defining them.'''
+        import hashlib
+        state, mtimes = [], {}
+        todo = [('', cmdtable)]
+        while todo:
+            prefix, table = todo.pop()
+            for key, entry in sorted(table.items()):
+                func = entry[0]
+                if isinstance(func, Dispatcher):
+                    todo.append((prefix + key + ' ', func._cmdtable))
+                    source = None
+                elif isinstance(func, LazyCommand):
+                    source = func.value
+                else:
+                    source = getattr(getattr(func, '__code__', None),
+                                     'co_filename', None)
+                    if source not in mtimes:
+                        try:
+                            mtimes[source] = os.stat(source).st_mtime_ns
+                        except (OSError, TypeError):
+                            mtimes[source] = None
+                state.append((prefix + key, source, mtimes.get(source),
+                              getattr(func, '__doc__', None)))
+        return hashlib.sha1(repr(state).encode()).hexdigest()
+
+    @classmethod
+    def build(cls, cmdtable):
+        commands, words = [], {}
+        todo = [('', cmdtable)]
+        while todo:
+            prefix, table = todo.pop()
+            for key, entry in table.items():
+                if key.startswith('~'):
+                    continue
+                aliases = aliases_(key)
+                func = entry[0]
+                doc = pretty_doc_string(func)
+                texts = [prefix + aliases[0], doc] + aliases[1:]
+                if isinstance(func, Dispatcher):
+                    todo.append((prefix + aliases[0] + ' ', func._cmdtable))
+                elif not isinstance(func, LazyCommand):
+                    try:
+                        texts.extend(o.name + ' ' + o.helpmsg
+                                     for o in entry[1])
+                    except OpsterError:
+                        pass  # broken options are reported when run
+                for text in texts:
+                    for word in re.findall(r'\w+', text.lower()):
+                        words.setdefault(word, set()).add(len(commands))
+                commands.append([prefix + aliases[0],
+                                 doc.strip().splitlines()[0].rstrip()])
+        return cls(commands, dict((word, sorted(ids))
+                                  for word, ids in sorted(words.items())))
+
+    def search(self, keyword):
+        '''Sorted names and summaries of commands matching all words of a
+        keyword (as prefixes of words in index).'''
+        found = None
+        for word in re.findall(r'\w+', keyword.lower()):
+            ids = set()
+            for match in prefixed(self.vocabulary, word):
+                ids.update(self.words[match])
+            found = ids if found is None else found & ids
+        return sorted(self.commands[i] for i in found or ())
+
+
 def help_cmd(func, usage, options, aliases, scriptname=None):
     '''Show help for given command.
 
@@ -375,7 +1335,7 @@ def help_options(options):
     yield 'options:\n'
     output = []
     for o in options:
-        default = o.default_value()
+        default = o.help_default()
         default = default and ' (default: %s)' % default or ''
         output.append(('%2s%s' % (o.short and '-%s' % o.short,
                                   o.name and ' --%s' % o.name),
@@ -417,6 +1377,7 @@ def Option(opt):
     # Extract and validate contents of tuple
     short, name, default, helpmsg = opt[:4]
     completer = opt[4] if len(opt) > 4 else None
+    annotation = opt[5] if len(opt) > 5 else None
     if short and len(short) != 1:
         raise OpsterError(
             'Short option should be only a single character: %s' % short)
@@ -427,10 +1388,16 @@ def Option(opt):
 
     args = pyname, name, short, default, helpmsg, completer
 
+    Typed = isinstance(opt, Declaration) and annotation_option(annotation,
+                                                                name)
+    if Typed:
+        return Typed(*args)
+
     # Find matching _Option subclass and return instance
     # nb. the order of testing matters
     for Type in (BoolOption, ListOption, DictOption, FuncOption,
-                 TupleOption, UnicodeOption, LiteralOption):
+                 TupleOption, FileOption, UnicodeOption, BytesOption,
+                 LiteralOption):
         if Type.matches(default):
             return Type(*args)
     raise OpsterError('Cannot figure out type for option %s' % name)
@@ -438,7 +1405,11 @@ def Option(opt):
 def CmdTable(cmdtable):
     '''Factory to convert option tuples in a cmdtable'''
     newtable = {}
-    for name, (func, opts, usage) in cmdtable.items():
+    for name, entry in cmdtable.items():
+        if isinstance(entry, CommandEntry):
+            newtable[name] = entry  # options are converted on first use
+            continue
+        func, opts, usage = entry
         newtable[name] = (func, [Option(o) for o in opts], usage)
     return newtable
 
@@ -446,6 +1417,8 @@ def CmdTable(cmdtable):
 class BaseOption(namedtuple('Option', (
             'pyname', 'name', 'short', 'default', 'helpmsg', 'completer'))):
     has_parameter = True
+    # if converted value can be shared between parses of a command line
+    reusable = True
     type = None
     _fmt = None
 
@@ -475,6 +1448,10 @@ class BaseOption(namedtuple('Option', (
         '''Shortcut to obtain the default value when option arg not provided.'''
         return self.convert(self.default_state())
 
+    def help_default(self):
+        '''Default value to show in help.'''
+        return self.default_value()
+
 
 class LiteralOption(BaseOption):
     '''Literal option type (including string, int, float, etc.)'''
@@ -496,6 +1473,16 @@ class UnicodeOption(BaseOption):
         return decodearg(final)
 
 
+class BytesOption(BaseOption):
+    '''Handle bytes values, giving argument as it was passed to program'''
+    type = bytes
+
+    def convert(self, final):
+        if isinstance(final, bytes):
+            return final
+        return os.fsencode(final)
+
+
 class BoolOption(BaseOption):
     '''Boolean option type.'''
     has_parameter = False
@@ -560,18 +1547,346 @@ class TupleOption(BaseOption):
 
 
 class FuncOption(BaseOption):
-    '''Function option type.'''
+    '''Function option type.
+
+    When option is not given, function is called with ``None`` only when
+    command uses the value (see ``LazyDefault``). Help shows ``label``
+    attribute of the function as a default value, if it's set.
+    '''
     type = Callable
+    reusable = False
 
     def default_state(self):
         return None
 
     def convert(self, final):
+        if final is None:
+            return LazyDefault(self.convert_default)
         return self.default(final)
 
+    def convert_default(self):
+        try:
+            return self.default(None)
+        except ValueError as e:
+            raise getopt.GetoptError('invalid default value for option %r: %s'
+                                     % (self.name, e))
+
+    def help_default(self):
+        return getattr(self.default, 'label', None)
+
+
+def lazy_operator(name):
+    def operator(self, *args):
+        return getattr(self._resolve(), name)(*args)
+    operator.__name__ = name
+    return operator
 
-def process(args, options):
+
+class LazyDefault(object):
+    '''Proxy for a value which is computed on first use.
+
+    It behaves like the value in most cases, but is not an instance of its
+    type: ``value._resolve()`` gives the value itself.
+
+    >>> calls = []
+    >>> value = LazyDefault(lambda x: calls.append(x) or 'test', None)
+    >>> calls
+    []
+    >>> value.upper(), value + '!', value == 'test', calls
+    ('TEST', 'test!', True, [None])
+    '''
+    __slots__ = ('_func', '_args', '_value')
+
+    def __init__(self, func, *args):
+        self._func = func
+        self._args = args
+        self._value = None
+
+    def _resolve(self):
+        if self._func is not None:
+            self._value = self._func(*self._args)
+            self._func = self._args = None
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    for name in ('__repr__', '__str__', '__bytes__', '__format__',
+                 '__bool__', '__len__', '__iter__', '__contains__',
+                 '__getitem__', '__setitem__', '__delitem__', '__call__',
+                 '__enter__', '__exit__', '__fspath__', '__index__',
+                 '__int__', '__float__', '__hash__', '__eq__', '__ne__',
+                 '__lt__', '__le__', '__gt__', '__ge__', '__add__',
+                 '__radd__', '__sub__', '__rsub__', '__mul__', '__rmul__',
+                 '__truediv__', '__rtruediv__', '__floordiv__', '__mod__',
+                 '__neg__', '__and__', '__or__', '__xor__'):
+        locals()[name] = lazy_operator(name)
+    del name
+
+
+def annotation_option(annotation, name):
+    '''Option class converting values to type from annotation of an option
+    declared with ``opt()``, ``None`` if type of an option is determined by
+    its default value.
+
+    >>> annotation_option(dict, 'defs')
+    >>> annotation_option(int, 'port').annotation
+    <class 'int'>
+    '''
+    import typing
+    if annotation is None or annotation is bool:
+        return None
+    # annotations with those types are handled by options made from defaults
+    default_types = (dict, tuple, File, LazyFile, Callable)
+    item = annotation
+    if annotation is list or typing.get_origin(annotation) is list:
+        item = (typing.get_args(annotation) or (str,))[0]
+    if typing.get_origin(item) is typing.Literal or (
+            isinstance(item, type) and not issubclass(item, default_types)):
+        return typed_option(annotation)
+    origin = typing.get_origin(annotation) or annotation
+    if not (isinstance(origin, type) and issubclass(origin, default_types)):
+        raise OpsterError('Unsupported annotation of option %s: %r'
+                          % (name, annotation))
+    return None
+
+
+@lru_cache(maxsize=None)
+def typed_option(annotation):
+    '''Create option class converting values to type from annotation.
+
+    >>> Port = typed_option(int)
+    >>> Port('port', 'port', 'p', 8000, '', None).convert('80')
+    80
+    >>> Ids = typed_option(list[int])
+    >>> Ids('ids', 'ids', 'i', [], '', None).convert(['1', '2'])
+    [1, 2]
+    '''
+    import typing
+    if annotation is list or typing.get_origin(annotation) is list:
+        base = ListOption
+        item = (typing.get_args(annotation) or (str,))[0]
+        convert_item = value_converter(item)
+        convert_value = lambda values: [convert_item(v) for v in values]
+        choices = getattr(convert_item, 'choices', None)
+    else:
+        base = LiteralOption
+        item = annotation
+        convert_value = value_converter(annotation)
+        choices = getattr(convert_value, 'choices', None)
+
+    def convert(self, final):
+        if final is self.default:
+            return final
+        return convert_value(final)
+
+    def help_default(self):
+        value = base.help_default(self)
+        return value.name if isinstance(value, Enum) else value
+
+    # other types can make values which are mutable or depend on time
+    reusable = choices is not None or item in (int, float, complex, str,
+                                               bytes)
+
+    return type('Typed' + base.__name__, (base,), {
+        'convert': convert, 'help_default': help_default,
+        'annotation': annotation, 'choices': choices, 'reusable': reusable})
+
+
+def value_converter(annotation):
+    '''Function converting a single value from command line to given type'''
+    import typing
+    if typing.get_origin(annotation) is typing.Literal:
+        return choice_converter(typing.get_args(annotation))
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        return choice_converter(list(annotation))
+    if annotation is str:
+        return decodearg
+    if annotation is bytes:
+        return os.fsencode
+    return annotation
+
+
+def choice_converter(choices):
+    '''Function picking one of choices (enum members by name) by value'''
+    byname = OrderedDict((str(c.name if isinstance(c, Enum) else c), c)
+                         for c in choices)
+    members = set(choices)
+
+    def convert(value):
+        if value in byname:
+            return byname[value]
+        if value in members:
+            return value
+        msg = "unrecognised value: %r (should be one of %s)"
+        raise getopt.GetoptError(msg % (value, ', '.join(byname)))
+    convert.choices = list(byname)
+    return convert
+
+
+class File(object):
+    '''Default value for an option taking a file name.
+
+    - ``path``: default file name, ``-`` means stdin (or stdout for writing)
+    - ``mode``: mode to open file with (``'r'``, ``'rb'``, ``'w'``, etc)
+    - ``mmap``: map file to memory instead of reading it, only for reading
+    - ``atomic``: write to a temporary file first, replacing target file only
+      when the command has succeeded
+    - ``encoding``: encoding of a text file
+
+    Command receives a ``LazyFile`` object, which opens the file only when
+    it is used.
+    '''
+
+    def __init__(self, path=None, mode='r', mmap=False, atomic=True,
+                 encoding=None):
+        if mmap and 'r' not in mode:
+            raise OpsterError('Only files opened for reading can be mapped')
+        self.path = path
+        self.mode = mode
+        self.mmap = mmap
+        self.atomic = atomic
+        self.encoding = encoding
+
+    def __repr__(self):
+        return 'File(%r, %r)' % (self.path, self.mode)
+
+
+class LazyFile(object):
+    '''File from command line, which is opened on first use.
+
+    Behaves like a regular file object. Files opened during dispatch are
+    closed after the command has finished, output files written atomically
+    are renamed to their place only if the command has succeeded.
     '''
+    # files opened so far outside of ``Dispatcher.invoke``, closed by
+    # ``closing_files``
+    opened = []
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.spec = spec
+        self._file = None
+        self._tmp = None
+        self._map = None
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return '<LazyFile %r, mode %r>' % (self.name, self.spec.mode)
+
+    def __fspath__(self):
+        return self.name
+
+    def open(self):
+        '''Open file (if it is not opened yet) and return file object.'''
+        if self._file is not None:
+            return self._file
+
+        spec = self.spec
+        binary = 'b' in spec.mode
+        if self.name == '-':
+            f = 'r' in spec.mode and sys.stdin or sys.stdout
+            self._file = binary and f.buffer or f
+        elif spec.atomic and 'r' not in spec.mode:
+            import tempfile
+            fd, self._tmp = tempfile.mkstemp(
+                dir=os.path.dirname(self.name) or '.', prefix='.opster-')
+            self._file = os.fdopen(fd, spec.mode.replace('a', 'w'),
+                                   encoding=spec.encoding)
+            if 'a' in spec.mode and os.path.exists(self.name):
+                with open(self.name, spec.mode.replace('a', 'r'),
+                          encoding=spec.encoding) as f:
+                    self._file.write(f.read())
+        else:
+            self._file = open(self.name, spec.mode, encoding=spec.encoding)
+        opened_files().append(self)
+        return self._file
+
+    def view(self):
+        '''Return contents of a file as a memoryview.
+
+        If file option has ``mmap=True``, file is mapped into memory and not
+        copied at all.
+        '''
+        if self._map is None:
+            f = self.open()
+            f = getattr(f, 'buffer', f)
+            if self.spec.mmap and self.name != '-':
+                import mmap
+                try:
+                    self._map = mmap.mmap(f.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+                except ValueError:  # empty file can't be mapped
+                    self._map = b''
+            else:
+                self._map = f.read()
+        return memoryview(self._map)
+
+    def close(self, discard=False):
+        '''Close file; temporary file is either put in place or deleted.'''
+        f, self._file = self._file, None
+        if f is None:
+            return
+        m, self._map = self._map, None
+        if hasattr(m, 'close'):
+            try:
+                m.close()
+            except BufferError:  # there are views still in use
+                pass
+        if self.name == '-':
+            if 'r' not in self.spec.mode:
+                f.flush()
+            return
+        f.close()
+        tmp, self._tmp = self._tmp, None
+        if tmp and discard:
+            os.unlink(tmp)
+        elif tmp:
+            # temporary files are private, give it mode of a replaced file
+            try:
+                mode = os.stat(self.name).st_mode & 0o7777
+            except FileNotFoundError:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0o666 & ~umask
+            os.chmod(tmp, mode)
+            os.replace(tmp, self.name)
+
+    def __getattr__(self, name):
+        return getattr(self.open(), name)
+
+    def __iter__(self):
+        return iter(self.open())
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close(discard=exc_type is not None)
+
+
+class FileOption(BaseOption):
+    '''File option type, see ``File``.'''
+    type = File
+    reusable = False
+
+    def default_state(self):
+        return self.default.path
+
+    def convert(self, final):
+        if final is None:
+            return None
+        return LazyFile(final, self.default)
+
+
+def process(args, options, as_bytes=False):
+    '''Parse options and arguments from the argument list.
+
+    If ``as_bytes`` is True, arguments are returned as ``bytes``.
+
     >>> opts = [('l', 'listen', 'localhost',
     ...          'ip to listen on'),
     ...         ('p', 'port', 8000,
@@ -586,6 +1901,9 @@ def process(args, options):
     '''
     options = [Option(o) for o in options]  # only for doctest
 
+    if as_bytes:
+        args = [os.fsdecode(a) for a in args]
+
     # Parse arguments and options
     args, opts = getopts(args, options)
 
@@ -596,6 +1914,10 @@ def process(args, options):
     for o, val in opts:
         state[o.pyname] = o.update_state(state[o.pyname], val)
 
+    # Help is shown without converting values of other options
+    if state.get('help') is True:
+        return args, state
+
     # Convert to required type
     for o in options:
         try:
@@ -604,6 +1926,9 @@ def process(args, options):
             raise getopt.GetoptError('invalid option value %r for option %r'
                 % (state[o.pyname], o.name))
 
+    if as_bytes:
+        args = [os.fsencode(a) for a in args]
+
     return args, state
 
 
@@ -612,14 +1937,35 @@ def getopts(args, options, preparse=False):
 
     If preparse is True, option processing stops at first non-option.
     '''
+    shortlist, namelist, argmap = getopt_spec(
+        tuple((o.short, o.name, o.has_parameter) for o in options), preparse)
+
+    # getopt.gnu_getopt allows options after the first non-option
+    opts, args = getopt.gnu_getopt(args, shortlist, namelist)
+
+    # map the option argument names back to their Option instances
+    opts = [(options[argmap[opt]], val) for opt, val in opts]
+
+    return args, opts
+
+
+@lru_cache(maxsize=256)
+def getopt_spec(key, preparse=False):
+    '''Arguments for getopt and map of option flags to positions of options.
+
+    ``key`` has ``(short, name, has_parameter)`` for every option, so that
+    commands parsed many times build this only once.
+
+    >>> getopt_spec((('p', 'port', True), ('d', 'daemonize', False)))
+    ('p:d', ['port=', 'daemonize'], {'-p': 0, '--port': 0, '-d': 1, '--daemonize': 1})
+    '''
     argmap = {}
     shortlist, namelist = '', []
-    for o in options:
-        argmap['-' + o.short] = argmap['--' + o.name] = o
+    for i, (short, name, has_parameter) in enumerate(key):
+        argmap['-' + short] = argmap['--' + name] = i
 
         # getopt wants indication that it takes a parameter
-        short, name = o.short, o.name
-        if o.has_parameter:
+        if has_parameter:
             if short:
                 short += ':'
             name += '='
@@ -631,13 +1977,7 @@ def getopts(args, options, preparse=False):
     if preparse:
         shortlist = '+' + shortlist
 
-    # getopt.gnu_getopt allows options after the first non-option
-    opts, args = getopt.gnu_getopt(args, shortlist, namelist)
-
-    # map the option argument names back to their Option instances
-    opts = [(argmap[opt], val) for opt, val in opts]
-
-    return args, opts
+    return shortlist, namelist, argmap
 
 # --------
 # Subcommand system
@@ -663,6 +2003,198 @@ def cmdparse(args, cmdtable, globalopts):
         return None, None, args, globalopts
 
 
+# number of command lines kept by ``Dispatcher.parse_string``
+PARSE_CACHE_SIZE = 4096
+
+# characters for which line can't be just split on whitespace: quotes,
+# escapes and whitespace which is not separating words for shlex
+SHELL_SPECIAL = re.compile(r'[\'"\\\x0b\x0c\x1c-\x1f\x85\xa0\u1680\u2000-\u200a'
+                           r'\u2028\u2029\u202f\u205f\u3000]')
+
+
+def split_command(line):
+    '''Split command line into words like ``shlex.split``.
+
+    >>> split_command('deploy --env prod  svc')
+    ['deploy', '--env', 'prod', 'svc']
+    >>> split_command('say "hello world"')
+    ['say', 'hello world']
+    '''
+    if not SHELL_SPECIAL.search(line):
+        return line.split()
+    import shlex
+    return shlex.split(line)
+
+
+class ParsedCommand(namedtuple('ParsedCommand', (
+        'command', 'args', 'options', 'argv'))):
+    '''Command line parsed by ``Dispatcher.parse_string``.'''
+    __slots__ = ()
+
+
+def frozen(value):
+    '''Read-only version of option values.
+
+    >>> frozen({'names': ['a', 'b'], 'env': {'x': '1'}})['names']
+    ('a', 'b')
+    '''
+    if isinstance(value, list):
+        return tuple(frozen(v) for v in value)
+    if isinstance(value, dict):
+        return MappingProxyType(dict((k, frozen(v)) for k, v in value.items()))
+    return value
+
+
+class CommandEntry(object):
+    '''Command table entry, which introspects its function on first use.
+
+    Behaves like a ``(func, options, usage)`` tuple, see
+    ``Dispatcher.register_many``.
+    '''
+    __slots__ = ('func', 'options', 'usage', 'resolved')
+
+    def __init__(self, func, options=None, usage=None):
+        self.func = func
+        self.options = options
+        self.usage = usage
+        self.resolved = False
+
+    def resolve(self):
+        '''Guess and convert options and usage, if it was not done yet.'''
+        if not self.resolved:
+            try:
+                options = [Option(o) for o in
+                           (self.options or guess_options(self.func))]
+            except TypeError:
+                options = []
+            if self.usage is None:
+                self.usage = guess_usage(self.func, options)
+            self.options = options
+            self.resolved = True
+        return self.func, self.options, self.usage
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __getitem__(self, index):
+        # function alone (e.g. for docstring in help) needs no introspection
+        if index == 0:
+            return self.func
+        return self.resolve()[index]
+
+
+class LazyCommand(object):
+    '''Command table entry of a plugin, which is not imported yet.'''
+
+    def __init__(self, value, doc):
+        self.value = value
+        self.__doc__ = doc
+        self.entry = None
+
+    def resolve(self):
+        '''Import plugin and return command table entry for it.'''
+        if self.entry is None:
+            import importlib
+            modname, _, attrs = self.value.partition(':')
+            try:
+                obj = importlib.import_module(modname.strip())
+                for attr in filter(None, attrs.strip().split('.')):
+                    obj = getattr(obj, attr)
+            except Exception as e:
+                raise OpsterError('cannot load plugin %s: %s'
+                                  % (self.value, e)) from e
+            self.entry = plugin_entry(obj)
+        return self.entry
+
+
+def plugin_entry(obj):
+    '''Make command table entry from an object given by entry point.'''
+    if isinstance(obj, Dispatcher):
+        return obj, [], None
+    if hasattr(obj, 'orig') and hasattr(obj, 'opts'):
+        # decorated with Dispatcher.command
+        return obj.orig, obj.opts, obj.usage
+    try:
+        options = [Option(o) for o in guess_options(obj)]
+    except TypeError:
+        options = []
+    return obj, options, guess_usage(obj, options)
+
+
+def plugin_index(group):
+    '''Load cached information about plugins of a group.
+
+    Plugins are not imported to build it, their help is a summary of a
+    package they come from.
+    '''
+    import json
+    path = cachedir('plugins', group + '.json')
+    fingerprint = installed_fingerprint()
+    try:
+        with open(path) as f:
+            index = json.load(f)
+        if index['fingerprint'] == fingerprint:
+            return index['plugins']
+    except (IOError, ValueError, KeyError):
+        pass
+
+    from importlib import metadata
+    try:
+        entry_points = metadata.entry_points(group=group)
+    except TypeError:  # python < 3.10
+        entry_points = metadata.entry_points().get(group, [])
+    plugins = []
+    for ep in entry_points:
+        dist = getattr(ep, 'dist', None)
+        plugins.append({'name': ep.name, 'value': ep.value,
+                        'dist': dist and dist.metadata['Name'],
+                        'version': dist and dist.version,
+                        'doc': dist and dist.metadata['Summary']})
+    try:
+        atomic_write(path, json.dumps({'fingerprint': fingerprint,
+                                       'plugins': plugins}))
+    except (IOError, OSError):
+        pass  # read-only cache is not a reason to fail
+    return plugins
+
+
+def installed_fingerprint():
+    '''Value which changes when packages are installed or removed.
+
+    Installing or removing a package changes modification time of a
+    directory it is installed into.
+    '''
+    state = [sys.version]
+    for path in sys.path:
+        try:
+            state.append((path, os.stat(path or '.').st_mtime_ns))
+        except OSError:
+            pass
+    return repr(state)
+
+
+def chain_stages(args, separator):
+    '''Split arguments into separate commands of a chain.
+
+    >>> chain_stages(['list', '+', 'filter', '-x', '+', 'export'], '+')
+    [['list'], ['filter', '-x'], ['export']]
+    >>> chain_stages(['list', '+'], None)
+    [['list', '+']]
+    '''
+    if not separator or separator not in args:
+        return [args]
+    stages = [[]]
+    for arg in args:
+        if arg == separator:
+            stages.append([])
+        else:
+            stages[-1].append(arg)
+    return stages
+
+
 def aliases_(cmdtable_key):
     '''Get aliases from a command table key.'''
     return cmdtable_key.lstrip("^~").split("|")
@@ -680,7 +2212,8 @@ def findpossible(cmd, table):
             found = cmd
         else:
             for a in aliases:
-                if re.search(pattern, a):
+                # internal commands (like _completion) need exact name
+                if not a.startswith('_') and re.search(pattern, a):
                     found = a
                     break
         if found is not None:
@@ -691,19 +2224,24 @@ def findpossible(cmd, table):
 
 def findcmd(cmd, table):
     """Return (aliases, command table entry) for command string."""
-    choice = findpossible(cmd, table)
-
-    if cmd in choice:
-        return choice[cmd]
-
-    if len(choice) > 1:
-        clist = sorted(choice.keys())
-        raise AmbiguousCommand(cmd, clist)
-
-    if choice:
-        return list(choice.values())[0]
+    # exact names win anyway, so fuzzy matching is needed only without them
+    for key, entry in table.items():
+        aliases = aliases_(key)
+        if cmd in aliases:
+            break
+    else:
+        choice = findpossible(cmd, table)
+        if len(choice) > 1:
+            clist = sorted(choice.keys())
+            raise AmbiguousCommand(cmd, clist)
+        elif choice:
+            aliases, entry = list(choice.values())[0]
+        else:
+            raise UnknownCommand(cmd)
 
-    raise UnknownCommand(cmd)
+    if isinstance(entry[0], LazyCommand):
+        entry = entry[0].resolve()
+    return aliases, entry
 
 
 # --------
@@ -726,14 +2264,38 @@ def guess_options(func):
     See docstring of ``command()`` for description of those variables.
     '''
     spec = inspect.getfullargspec(func)
+
+    def make(name, option):
+        declared = isinstance(option, Declaration)
+        option = (option[0], name_from_python(name)) + option[1:]
+        if not declared:
+            return option
+        # only options declared with opt() are typed by annotations
+        annotation = resolve_annotation(func, spec.annotations.get(name))
+        return Declaration((option + (None,) * 5)[:5] + (annotation,))
+
     if spec.args and spec.defaults:
         for name, option in zip(spec.args[-len(spec.defaults):], spec.defaults):
             if isinstance(option, tuple):
-                yield (option[0], name_from_python(name)) + option[1:]
+                yield make(name, option)
     for name in spec.kwonlyargs:
-        option = spec.kwonlydefaults[name]
+        option = (spec.kwonlydefaults or {}).get(name)
         if isinstance(option, tuple):
-            yield (option[0], name_from_python(name)) + option[1:]
+            yield make(name, option)
+
+
+def resolve_annotation(func, annotation):
+    '''Evaluate annotation given as a string (postponed evaluation).
+
+    Names which cannot be resolved (imported only for type checkers) give
+    ``None``, so that type of an option is determined by its default.
+    '''
+    if not isinstance(annotation, str):
+        return annotation
+    try:
+        return eval(annotation, getattr(func, '__globals__', {}))
+    except Exception:
+        return None
 
 
 def guess_usage(func, options):
@@ -759,10 +2321,45 @@ def guess_usage(func, options):
     return ' '.join(usage)
 
 
-@contextmanager
-def help_workaround(func, scriptname, help_func=None):
-    '''Context manager to temporarily replace func.help'''
-    # Retrieve inner if function is command wrapped
+@lru_cache(maxsize=None)
+def signature(func):
+    '''Cached signature of a command, used to check its arguments.'''
+    return inspect.signature(func)
+
+
+@lru_cache(maxsize=None)
+def parameter_names(func):
+    '''Names of parameters which can be passed to ``func`` by keyword.'''
+    spec = inspect.getfullargspec(func)
+    return tuple(spec.args + spec.kwonlyargs)
+
+
+@contextmanager
+def closing_files():
+    '''Context manager to close files of file options opened inside of it.
+
+    Output files are put in place only if no exception (besides
+    ``SystemExit``) was raised.
+    '''
+    opened = opened_files()
+    start = len(opened)
+    failed = False
+    try:
+        yield
+    except (Exception, KeyboardInterrupt):
+        failed = True
+        raise
+    finally:
+        files = opened[start:]
+        del opened[start:]
+        for f in files:
+            f.close(discard=failed)
+
+
+@contextmanager
+def help_workaround(func, scriptname, help_func=None):
+    '''Context manager to temporarily replace func.help'''
+    # Retrieve inner if function is command wrapped
     func = getattr(func, '_inner', func)
 
     # Ignore function that was not command wrapped
@@ -792,30 +2389,40 @@ def exchandle(help_func, cmd=None):
         return
     except UnknownCommand as e:
         err("unknown command: '%s'" % e)
+        handled = e
     except AmbiguousCommand as e:
         err("command '%s' is ambiguous:\n    %s" %
             (e.args[0], ' '.join(e.args[1])))
+        handled = e
     except ParseError as e:
         err('%s: %s\n' % (e.args[0], e.args[1].strip()))
         help_func(cmd)
+        handled = e
     except getopt.GetoptError as e:
         err('error: %s\n' % e)
         help_func(cmd)
+        handled = e
     except OpsterError as e:
         err('%s' % e)
+        handled = e
     # abort if a handled exception was raised
-    raise ErrorHandled()
+    raise ErrorHandled() from handled
 
 
-def call_cmd(name, func, opts, middleware=None):
+def call_cmd(name, func, opts, middleware=None, wrapped=None):
     '''Wrapper for command call, catching situation with insufficient arguments.
+
+    ``wrapped`` is a function already wrapped with middlewares and number of
+    wrappers, as returned by ``Dispatcher.compose``.
     '''
     # depth is necessary when there is a middleware in setup
     try:
         arginfo = inspect.getfullargspec(func)
     except ValueError:
         arginfo = inspect.getfullargspec(func)
-    if middleware:
+    if wrapped:
+        tocall, depth = wrapped[0], wrapped[1] + 1
+    elif middleware:
         tocall = middleware(func)
         depth = 2
     else:
@@ -839,6 +2446,8 @@ def call_cmd(name, func, opts, middleware=None):
                         tuple(kwargs.pop(x) for x in prepend) +
                         args[start:])
 
+        if ImportRecorder.active:
+            ImportRecorder.active.phase = name
         try:
             return tocall(*args, **kwargs)
         except TypeError:
@@ -894,6 +2503,656 @@ def call_cmd_regular(func, opts):
     return inner
 
 
+def cachedir(*parts):
+    '''Path inside of opster's cache directory.
+
+    Taken from ``OPSTER_CACHE_DIR`` if set, ``$XDG_CACHE_HOME/opster``
+    otherwise.
+    '''
+    base = os.environ.get('OPSTER_CACHE_DIR')
+    if not base:
+        base = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                            os.path.join(os.path.expanduser('~'), '.cache'),
+                            'opster')
+    return os.path.join(base, *parts)
+
+
+def atomic_write(path, data):
+    '''Write data to a file so that readers never see it half-written.'''
+    import tempfile
+    dirname = os.path.dirname(path) or '.'
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.opster-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data if isinstance(data, bytes) else data.encode('utf-8'))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class LRU(object):
+    '''Mapping which keeps at most ``maxsize`` most recently used items.
+
+    >>> lru = LRU(2)
+    >>> lru['a'] = 1; lru['b'] = 2
+    >>> lru.get('a')
+    1
+    >>> lru['c'] = 3
+    >>> sorted(lru.data)
+    ['a', 'c']
+    '''
+
+    def __init__(self, maxsize, items=()):
+        self.maxsize = maxsize
+        self.data = OrderedDict(items)
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            return default
+        self.data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.data)
+
+
+def pop_reserved(opts, options, option, default=None):
+    '''Take value of opster's own global option out of parsed options.'''
+    if option in options:
+        return opts.pop(option.pyname)
+    return default
+
+
+def output(result, fmt='text'):
+    '''Stream result of a command if it is an iterator.
+
+    Other results are returned as is and used as an exit code.
+    '''
+    if isinstance(result, Iterator):
+        return stream(result, fmt)
+    return result
+
+
+def stream(records, fmt='text', out=None):
+    '''Write records to a stream (stdout by default) as soon as they appear.
+
+    Unlike ``write`` output is not flushed after each record. If reader of
+    the stream goes away (like ``prog | head``), writing is stopped and 1 is
+    returned.
+
+    >>> stream(iter(['a', {'b': 1}]), 'jsonl')
+    "a"
+    {"b": 1}
+    '''
+    out = out or sys.stdout
+    writer = WRITERS[fmt](out)
+    try:
+        for record in records:
+            writer(record)
+        out.flush()
+    except BrokenPipeError:
+        # prevent another error when python flushes stdout on exit
+        try:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, out.fileno())
+        except (AttributeError, ValueError, OSError):
+            pass
+        return 1
+
+
+def text_writer(out):
+    def write_record(record):
+        if isinstance(record, (tuple, list)):
+            record = '\t'.join(str(x) for x in record)
+        out.write('%s\n' % (record,))
+    return write_record
+
+
+def jsonl_writer(out):
+    import json
+    def write_record(record):
+        out.write(json.dumps(record, default=str) + '\n')
+    return write_record
+
+
+def csv_writer(out):
+    import csv
+    writer = []
+
+    def write_record(record):
+        if not writer:
+            if isinstance(record, dict):
+                # header comes from the first record, other keys are left out
+                writer.append(csv.DictWriter(out, list(record),
+                                             extrasaction='ignore',
+                                             lineterminator='\n'))
+                writer[0].writeheader()
+            else:
+                writer.append(csv.writer(out, lineterminator='\n'))
+        if isinstance(record, dict):
+            writer[0].writerow(record)
+        elif isinstance(record, (tuple, list)):
+            writer[0].writerow(record)
+        else:
+            writer[0].writerow([record])
+    return write_record
+
+
+WRITERS = {'text': text_writer, 'jsonl': jsonl_writer, 'csv': csv_writer}
+
+
+class ResultCache(object):
+    '''On-disk cache of command results.
+
+    Command with a cache is not called if it was already called with the
+    same arguments and options; its output and exit code are replayed
+    instead. It's suitable only for commands which depend on nothing else
+    than their arguments and files listed in ``inputs``.
+
+    - ``inputs``: names of options, which contain names of input files (or
+      a function returning list of file names from ``(args, opts)``); cache
+      is invalidated when any of those files change
+    - ``hash_inputs``: compare contents of input files rather than their
+      modification time and size
+    - ``maxsize``: maximum size of a cache directory in bytes
+    - ``path``: directory to keep cached results in
+    - ``cache_failures``: cache results with non-zero exit codes too
+
+    Output interrupted by a closed pipe (like ``prog | head``) is not cached.
+    '''
+
+    def __init__(self, inputs=(), hash_inputs=False, maxsize=64 * 1024 * 1024,
+                 path=None, cache_failures=False):
+        self.inputs = inputs
+        self.hash_inputs = hash_inputs
+        self.maxsize = maxsize
+        self.path = path or cachedir('results')
+        self.cache_failures = cache_failures
+
+    def key(self, func, args, opts, fmt):
+        '''Compute cache key for a command call.'''
+        import json, hashlib
+        if callable(self.inputs):
+            paths = self.inputs(args, opts)
+        else:
+            paths = []
+            for name in self.inputs:
+                value = opts.get(name_to_python(name))
+                if isinstance(value, (list, tuple)):
+                    paths.extend(value)
+                elif value is not None:
+                    paths.append(value)
+        stats = [self.fingerprint(os.fspath(p)) for p in paths]
+        data = [self.program(func), func.__module__, func.__qualname__, args,
+                sorted(opts.items()), fmt, stats]
+        data = json.dumps(data, default=repr, sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    @staticmethod
+    def program(func):
+        '''Script of a command and file defining it, with its modification
+        time, so that results of different programs are kept apart and
+        changing a command invalidates its results.'''
+        module = sys.modules.get(func.__module__)
+        script = getattr(module, '__file__', None) or sys.argv[0]
+        code = getattr(inspect.unwrap(func), '__code__', None)
+        source = code and code.co_filename
+        try:
+            mtime = os.stat(source).st_mtime_ns
+        except (OSError, TypeError):
+            mtime = None
+        return [os.path.abspath(script), source, mtime]
+
+    def fingerprint(self, path):
+        try:
+            if self.hash_inputs:
+                import hashlib
+                with open(path, 'rb') as f:
+                    return [path, hashlib.sha256(f.read()).hexdigest()]
+            st = os.stat(path)
+            return [path, st.st_mtime_ns, st.st_size]
+        except (IOError, OSError):
+            return [path, None]
+
+    def call(self, func, args, opts, fmt, run):
+        '''Replay cached result of a command or run it and cache result.'''
+        import json
+        path = os.path.join(self.path, self.key(func, args, opts, fmt))
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (IOError, ValueError):
+            cached = None
+        if cached:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            sys.stdout.write(cached['stdout'])
+            sys.stdout.flush()
+            if cached['exit']:
+                sys.exit(cached['code'])
+            return cached['code']
+
+        # output is captured through streams of current invocation, so that
+        # output of other threads does not get into it
+        install_stream_proxies()
+        stdin, stdout, stderr = [stream.target() for stream in
+                                 (sys.stdin, sys.stdout, sys.stderr)]
+        tee = Tee(stdout)
+        outer = current_invocation.get()
+        token = current_invocation.set(InvocationState(
+            (stdin, tee, stderr), outer and outer.parsed, opened_files()))
+        try:
+            code = run()
+        except SystemExit as e:
+            self.store(path, tee, e.code, True)
+            raise
+        finally:
+            current_invocation.reset(token)
+        self.store(path, tee, code)
+        return code
+
+    def store(self, path, tee, code, exited=False):
+        import json
+        if tee.broken or not isinstance(code, (int, type(None))):
+            return
+        if code and not self.cache_failures:
+            return
+        result = {'stdout': tee.captured.getvalue(), 'code': code,
+                  'exit': exited}
+        atomic_write(path, json.dumps(result))
+        self.evict()
+
+    def evict(self):
+        '''Remove least recently used results exceeding ``maxsize``.'''
+        entries = []
+        for entry in os.scandir(self.path):
+            try:
+                st = entry.stat()
+            except OSError:  # removed by a concurrent process
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxsize:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class Tee(object):
+    '''Text stream writing to another stream and remembering output.'''
+
+    def __init__(self, out):
+        self.out = out
+        self.captured = io.StringIO()
+        self.broken = False
+
+    def write(self, text):
+        self.captured.write(text)
+        try:
+            return self.out.write(text)
+        except BrokenPipeError:
+            self.broken = True
+            raise
+
+    def flush(self):
+        try:
+            self.out.flush()
+        except BrokenPipeError:
+            self.broken = True
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+
+def hooks_middleware(hooks, name):
+    '''Make decorator from a middleware object with before/after/error hooks.
+    '''
+    before = getattr(hooks, 'before', None)
+    after = getattr(hooks, 'after', None)
+    error = getattr(hooks, 'error', None)
+
+    def decorator(func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            if before:
+                before(name, args, kwargs)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if error:
+                    error(name, e)
+                raise
+            if after:
+                result = after(name, result)
+            return result
+        return inner
+    return decorator
+
+
+class Sampler(object):
+    '''Statistical profiler writing stacks in collapsed (folded) format.
+
+    Stack of the main thread is recorded on ``SIGPROF``, which is delivered
+    each ``interval`` seconds of CPU time used by the process. Output is a
+    line per distinct stack, with frames separated by ``;`` and followed by a
+    number of samples, which is what flamegraph tools consume. Frames of
+    opster itself (parsing, dispatching, middleware plumbing) are labelled
+    ``[opster] name``, others ``name (file:line)``.
+    '''
+    active = False
+
+    def __init__(self, path, interval=SAMPLE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.counts = {}
+        self.labels = {}
+
+    def label(self, code):
+        if code.co_filename == OPSTER_FILE:
+            return '[opster] %s' % code.co_name
+        return '%s (%s:%d)' % (getattr(code, 'co_qualname', code.co_name),
+                               os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+    def sample(self, signum, frame):
+        labels = self.labels
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            try:
+                stack.append(labels[code])
+            except KeyError:
+                stack.append(labels.setdefault(code, self.label(code)))
+            frame = frame.f_back
+        key = ';'.join(reversed(stack))
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def __enter__(self):
+        import signal
+        Sampler.active = True
+        self.previous = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return self
+
+    def __exit__(self, *exc):
+        import signal
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous)
+        Sampler.active = False
+        atomic_write(self.path, ''.join('%s %d\n' % item for item in
+                                        sorted(self.counts.items())))
+
+
+class ImportRecorder(object):
+    '''Meta path finder recording time and memory spent importing modules.
+
+    Installed when opster is imported with ``OPSTER_IMPORTS`` set to a file
+    name (or ``-`` for stderr), where report is written on exit. Every
+    import is attributed to the module executing at the moment and to the
+    phase it happened in: startup or the command being run. Times are
+    cumulative like in ``python -X importtime``, memory is the growth of
+    memory traced by ``tracemalloc`` while module was executed.
+    '''
+    active = None
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+        self.stack = []
+        self.phase = None
+
+    @classmethod
+    def install(cls, path, preloaded=None):
+        '''Start recording imports.
+
+        ``preloaded`` are modules loaded, time and traced memory before
+        opster's own imports, which are then recorded as imported by
+        ``opster`` (without time and memory of every module).
+        '''
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        cls.active = recorder = cls(path)
+        if preloaded:
+            modules, start, memory = preloaded
+            recorder.records.append(ImportRecord(
+                'opster', None, None, time.perf_counter() - start,
+                tracemalloc.get_traced_memory()[0] - memory))
+            recorder.records.extend(
+                ImportRecord(name, 'opster', None, None, None)
+                for name in sorted(set(sys.modules) - modules)
+                if name != __name__)
+        import atexit
+        sys.meta_path.insert(0, recorder)
+        atexit.register(recorder.report)
+        return recorder
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            find = getattr(finder, 'find_spec', None)
+            if finder is self or find is None:
+                continue
+            spec = find(name, path, target)
+            if spec is None:
+                continue
+            if hasattr(spec.loader, 'exec_module'):
+                spec.loader = RecordingLoader(spec.loader, self)
+            return spec
+        return None
+
+    def execute(self, module, loader):
+        import tracemalloc
+        parent = self.stack[-1] if self.stack else None
+        self.stack.append(module.__name__)
+        memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            loader.exec_module(module)
+        finally:
+            self.stack.pop()
+            self.records.append(ImportRecord(
+                module.__name__, parent, self.phase,
+                time.perf_counter() - start,
+                tracemalloc.get_traced_memory()[0] - memory))
+
+    def roots(self, phase):
+        '''Records of modules imported directly in ``phase``, with lists of
+        all modules imported by them.'''
+        records = [r for r in self.records if r.phase == phase]
+        byname = dict((r.name, r) for r in records)
+        groups = OrderedDict((r.name, []) for r in records
+                             if r.parent not in byname)
+        for r in records:
+            root = r
+            while root.parent in byname:
+                root = byname[root.parent]
+            if root is not r:
+                groups[root.name].append(r)
+        return sorted(((byname[name],
+                        sorted(deps, key=lambda r: -(r.time or 0)))
+                       for name, deps in groups.items()),
+                      key=lambda group: -group[0].time)
+
+    def report(self):
+        '''Write imports grouped by phase and module which started them.'''
+        lines = ['imports (cumulative time, memory):']
+        for phase in OrderedDict.fromkeys(r.phase for r in self.records):
+            lines.append(phase and 'command %s:' % phase or 'startup:')
+            for root, deps in self.roots(phase):
+                lines.append('  ' + root.format(30))
+                lines.extend('    ' + r.format(28) for r in deps)
+        self.write(lines)
+
+    def leaks(self, cmdtable):
+        '''Report commands from other modules than the main one, which are
+        imported (with their dependencies) on every start of the program.'''
+        lines = []
+        startup = dict((root.name, (root, deps))
+                       for root, deps in self.roots(None))
+        for key, entry in sorted(cmdtable.items()):
+            module = getattr(entry[0], '__module__', None)
+            if (key.startswith('~') or module not in startup or
+                    module == __name__):
+                continue
+            root, deps = startup[module]
+            lines.append((root.time, '%s: %s imported at startup (%s)%s' % (
+                aliases_(key)[0], module, root.cost(),
+                deps and ': ' + ', '.join(r.name for r in deps) or '')))
+        self.write([line for t, line in sorted(lines, reverse=True)])
+
+    def write(self, lines):
+        text = '\n'.join(lines) + '\n'
+        if self.path == '-':
+            sys.stderr.write(text)
+        else:
+            with open(self.path, 'a') as f:
+                f.write(text)
+
+
+class ImportRecord(namedtuple('ImportRecord', (
+        'name', 'parent', 'phase', 'time', 'memory'))):
+    def cost(self):
+        memory = self.memory
+        for unit in ('B', 'kB', 'MB', 'GB'):
+            if abs(memory) < 1024 or unit == 'GB':
+                break
+            memory /= 1024.0
+        return '%.1fms, %.1f%s' % (self.time * 1000, memory, unit)
+
+    def format(self, width):
+        if self.time is None:  # imported by opster, not measured apart
+            return self.name
+        return '%-*s %s' % (width, self.name, self.cost())
+
+
+class RecordingLoader(object):
+    '''Loader passing execution of a module through ``ImportRecorder``.'''
+
+    def __init__(self, loader, recorder):
+        self.loader = loader
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.recorder.execute(module, self.loader)
+
+
+# frames with this file name belong to opster in samples
+OPSTER_FILE = sampled.__code__.co_filename
+
+
+def watched_paths(func, opts):
+    '''Files to watch for a command: declared ones and its input files.
+
+    Returns them and output files of a command, which are not watched.
+    '''
+    paths = list(getattr(func, 'watch', ()))
+    outputs = set()
+    for value in opts.values():
+        if not isinstance(value, LazyFile) or value.name == '-':
+            continue
+        if set(value.spec.mode) & set('wax+'):
+            outputs.add(os.path.abspath(value.name))
+        else:
+            paths.append(value.name)
+    return paths, outputs
+
+
+def snapshot(paths, ignore=()):
+    '''Get modification times and sizes of files in paths.
+
+    ``ignore`` is a set of absolute paths of files to leave out.
+    '''
+    state = {}
+    todo = list(paths)
+    while todo:
+        path = todo.pop()
+        if ignore and os.path.abspath(path) in ignore:
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if not os.path.isdir(path):
+            state[path] = st.st_mtime_ns, st.st_size
+            continue
+        try:
+            for entry in os.scandir(path):
+                if entry.name.startswith('.') or entry.name == '__pycache__':
+                    continue
+                if entry.is_dir():
+                    todo.append(entry.path)
+                elif ignore and os.path.abspath(entry.path) in ignore:
+                    continue
+                else:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    state[entry.path] = st.st_mtime_ns, st.st_size
+        except OSError:
+            continue
+    return state
+
+
+def watch(paths, run, name, interval=0.5, debounce=0.2, ignore=()):
+    '''Call ``run`` and call it again every time some of files change.
+
+    Files in ``ignore`` are not watched. Runs until interrupted with Ctrl-C,
+    returning result of the last call.
+    '''
+    while True:
+        # files changed while the command runs make it run again
+        state = snapshot(paths, ignore)
+        try:
+            result = run()
+        except ErrorHandled:
+            result = -1
+        except Exception:
+            traceback.print_exc()
+            result = -1
+
+        try:
+            while True:
+                time.sleep(interval)
+                current = snapshot(paths, ignore)
+                if current == state:
+                    continue
+                # wait for a burst of changes to finish
+                while True:
+                    time.sleep(debounce)
+                    state, current = current, snapshot(paths, ignore)
+                    if current == state:
+                        break
+                break
+        except KeyboardInterrupt:
+            return result
+        err('files changed, running %s again' % name)
+
+
 def replace_name(usage, name):
     '''Replace name placeholder with a command name.'''
     if '%name' in usage:
@@ -929,12 +3188,147 @@ def name_to_python(name):
     return name
 
 
+# global option to choose format of streamed output, see Dispatcher
+FORMAT_OPTION = Option(('', 'format', ('text', 'jsonl', 'csv'),
+                        'format of command output'))
+WATCH_OPTION = Option(('', 'watch', False,
+                       'run command again when its input files change'))
+# options of help command
+HELP_OPTIONS = [Option(('k', 'keyword', '',
+                        'list commands with words in their names or help'))]
+SCHEDULER_OPTIONS = [Option(o) for o in (
+    ('w', 'workers', 4, 'number of commands run at once'),
+    ('', 'once', False, 'run commands due in current minute and exit'),
+    ('l', 'log', '-', 'file to append records of runs to'))]
+
+
+class Invocation(namedtuple('Invocation', (
+        'code', 'stdout', 'stderr', 'command', 'args', 'options', 'result',
+        'exception'))):
+    '''Outcome of ``Dispatcher.invoke``.'''
+
+
+# state of current ``Dispatcher.invoke`` call
+current_invocation = contextvars.ContextVar('opster_invocation', default=None)
+
+
+class InvocationState(object):
+    '''Streams, parsed command line and opened files of an invocation.
+
+    Invocations running in parallel threads do not share any of them.
+    '''
+    __slots__ = ('streams', 'parsed', 'opened')
+
+    def __init__(self, streams, parsed=None, opened=None):
+        self.streams = streams
+        self.parsed = {} if parsed is None else parsed
+        self.opened = [] if opened is None else opened
+
+
+def opened_files():
+    '''List of files opened by current invocation, see ``closing_files``.'''
+    invocation = current_invocation.get()
+    return invocation.opened if invocation else LazyFile.opened
+
+
+class StreamProxy(object):
+    '''Standard stream redirected to a stream of current invocation, if any.
+    '''
+
+    def __init__(self, index, default):
+        self.index = index
+        self.default = default
+
+    def target(self):
+        invocation = current_invocation.get()
+        return invocation.streams[self.index] if invocation else self.default
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+    def __iter__(self):
+        return iter(self.target())
+
+
+def install_stream_proxies():
+    '''Replace standard streams with ``StreamProxy``, if not done already.'''
+    for index, name in enumerate(('stdin', 'stdout', 'stderr')):
+        stream = getattr(sys, name)
+        if not isinstance(stream, StreamProxy):
+            setattr(sys, name, StreamProxy(index, stream))
+
+
+class SpooledOutput(io.RawIOBase):
+    '''Output kept in memory up to ``max_size`` bytes, in a temporary file
+    after that.'''
+
+    def __init__(self, max_size):
+        import tempfile
+        self.spool = tempfile.SpooledTemporaryFile(max_size)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.spool.write(data)
+
+    def getvalue(self):
+        self.spool.seek(0)
+        value = self.spool.read()
+        self.close()
+        return value
+
+    def close(self):
+        self.spool.close()
+        io.RawIOBase.close(self)
+
+
+@contextmanager
+def environment(env):
+    '''Context manager to update ``os.environ`` temporarily.'''
+    if not env:
+        yield
+        return
+    saved = dict((name, os.environ.get(name)) for name in env)
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def strip_program(argv, scriptname):
+    '''Arguments after program name, if it is given (like in crontab).
+
+    >>> strip_program(['python', '/bin/prog', 'cmd', '-v'], 'prog')
+    ['cmd', '-v']
+    '''
+    names = [os.path.basename(arg) for arg in argv]
+    if scriptname in names:
+        return argv[names.index(scriptname) + 1:]
+    return argv
+
+
+def exit_status(code):
+    '''Exit status of a process calling ``sys.exit(code)``.'''
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code & 0xff
+    err('%s' % code)
+    return 1
+
+
 # --------
 # Autocomplete system
 # --------
 
 # Borrowed from PIP
-def autocomplete(cmdtable, args, middleware):
+def autocomplete(index, middleware):
     '''Command and option completion.
 
     Enable by sourcing one of the completion shell scripts (bash or zsh).
@@ -946,40 +3340,330 @@ def autocomplete(cmdtable, args, middleware):
     cwords = os.environ['COMP_WORDS'].split()[1:]
     cword = int(os.environ['COMP_CWORD'])
 
+    print(' '.join(completions(index, cwords, cword, middleware)))
+    sys.exit(1)
+
+
+class CompletionIndex(object):
+    '''Sorted names of commands and their options for fast completion.
+
+    Options of commands and nested dispatchers are indexed on first use.
+    '''
+
+    def __init__(self, cmdtable, globalopts):
+        self.globalopts = globalopts
+        self.commands = {}
+        for key, entry in cmdtable.items():
+            aliases = aliases_(key)
+            for alias in aliases:
+                self.commands[alias] = aliases[0], entry
+        self.names = sorted(self.commands)
+        self.globals = self.optindex(globalopts)
+        self.levels = {}
+
+    @staticmethod
+    def optindex(options):
+        lookup = {}
+        for o in options:
+            lookup['--' + o.name] = o
+            if o.short:
+                lookup['-' + o.short] = o
+        return sorted(lookup), lookup
+
+    def level(self, name):
+        '''Index of a nested dispatcher or options of a command.'''
+        try:
+            return self.levels[name]
+        except KeyError:
+            pass
+        func, opts, usage = self.commands[name][1]
+        if isinstance(func, LazyCommand):
+            try:
+                func, opts, usage = func.resolve()
+            except OpsterError:
+                opts = []  # broken plugin is reported when it's run
+        if isinstance(func, Dispatcher):
+            level = func.completion_index()
+        else:
+            opts = list(opts)
+            merge_globalopts(self.globalopts, opts)
+            level = self.optindex(opts)
+        self.levels[name] = level
+        return level
+
+
+def prefixed(names, prefix):
+    '''Items of a sorted list starting with a prefix.
+
+    >>> prefixed(['a', 'ba', 'bb', 'c'], 'b')
+    ['ba', 'bb']
+    '''
+    start = bisect.bisect_left(names, prefix)
+    end = start
+    while end < len(names) and names[end].startswith(prefix):
+        end += 1
+    return names[start:end]
+
+
+def completions(index, cwords, cword, middleware=None):
+    '''Get possible values for a word number ``cword`` of a command line.
+
+    ``cwords`` is a command line without program name, ``cword`` counts from 1.
+    '''
     try:
         current = cwords[cword - 1]
     except IndexError:
         current = ''
+    # shells split --option=value into three words
+    if current == '=':
+        current = ''
+    words = iter(w for w in cwords[:cword - 1] if w != '=')
+
+    # find command, descending into nested dispatchers
+    level, name, expects = index, None, None
+    for word in words:
+        if expects:
+            expects = None
+        elif word.startswith('-'):
+            opt = level.globals[1].get(word.split('=', 1)[0])
+            if opt and opt.has_parameter and '=' not in word:
+                expects = opt
+        elif word not in level.commands:
+            return []
+        elif isinstance(level.level(word), CompletionIndex):
+            level = level.level(word)
+        else:
+            name = word
+            break
+
+    if name is None:
+        if expects:
+            return option_values(expects, None, current, middleware)
+        if current.startswith('-'):
+            return prefixed(level.globals[0], current)
+        # internal commands are shown only when asked for
+        return [n for n in prefixed(level.names, current)
+                if current.startswith('_') or not n.startswith('_')]
+
+    names, lookup = level.level(name)
+    cmd = level.commands[name][0]
+    consumed = set()
+    for word in words:
+        if expects:
+            expects = None
+            continue
+        opt = lookup.get(word.split('=', 1)[0])
+        if opt is None:
+            continue
+        if not isinstance(opt, (ListOption, DictOption)):
+            consumed.add(opt.name)
+        if opt.has_parameter and '=' not in word:
+            expects = opt
+
+    if expects:
+        return option_values(expects, cmd, current, middleware)
+    if current.startswith('--') and '=' in current:
+        optname, prefix = current.split('=', 1)
+        opt = lookup.get(optname)
+        if opt is None:
+            return []
+        return [optname + '=' + value for value in
+                option_values(opt, cmd, prefix, middleware)]
+    if not current or current.startswith('-'):
+        return [o for o in prefixed(names, current)
+                if lookup[o].name not in consumed]
+    return []
+
+
+def option_values(opt, cmd, current, middleware=None):
+    '''Possible values of an option.'''
+    if opt.completer:
+        key = '%s %s %s' % (cmd, opt.name, current)
+        return list(run_completer(opt.completer, key, current, middleware))
+    if isinstance(opt, TupleOption):
+        return [str(v) for v in opt.default if str(v).startswith(current)]
+    if getattr(opt, 'choices', None):
+        return [v for v in opt.choices if v.startswith(current)]
+    return []
+
+
+# number of entries kept in completion cache and time (in seconds) a cached
+# completer may take before its partial results are used
+COMPLETION_CACHE_SIZE = int(os.environ.get('OPSTER_COMPLETION_CACHE_SIZE',
+                                           1000))
+COMPLETION_DEADLINE = float(os.environ.get('OPSTER_COMPLETION_DEADLINE', 0.5))
+
+
+def cached_completer(ttl, deadline=None):
+    '''Decorator to cache results of an option completer on disk.
+
+    Results are reused for ``ttl`` seconds and refreshed in background after
+    that. If the completer takes longer than ``deadline`` seconds (default is
+    ``COMPLETION_DEADLINE``), whatever it has produced so far is used.
+    '''
+    def wrapper(func):
+        func.ttl = ttl
+        func.deadline = deadline
+        return func
+    return wrapper
 
-    commands = []
-    for k in cmdtable.keys():
-        commands += aliases_(k)
 
-    # command
-    if cword == 1:
-        print(' '.join([x for x in commands if x.startswith(current)]))
+def run_completer(completer, key, current, middleware=None):
+    '''Call option completer, using completion cache if it asks for it.'''
+    ttl = getattr(completer, 'ttl', None)
+    deadline = getattr(completer, 'deadline', None) or COMPLETION_DEADLINE
+    if middleware:
+        completer = middleware(completer)
+    if not ttl:
+        return completer(current)
+
+    cache = completion_cache()
+    entry = cache.get(key)
+    if entry and time.time() - entry[0] < ttl:
+        return entry[1]
+    if entry:
+        # stale, but still better than waiting
+        refresh_completion(completer, key, current)
+        return entry[1]
+
+    results, finished = collect(completer, current, deadline)
+    if finished:
+        store_completion(key, results)
+    else:
+        refresh_completion(completer, key, current)
+    return results
 
-    # command options
-    elif cwords[0] in commands:
-        idx = -2 if current else -1
-        options = []
-        aliases, (cmd, opts, usage) = findcmd(cwords[0], cmdtable)
 
-        for o in opts:
-            short = '-%s' % o.short
-            name = '--%s' % o.name
-            options += [short, name]
+def completion_path():
+    '''Path to completion cache of the running program.'''
+    import hashlib
+    program = os.fsencode(os.path.abspath(sys.argv[0]))
+    return cachedir('completion', hashlib.sha1(program).hexdigest() + '.json')
 
-            completer = o.completer
-            if cwords[idx] in (short, name) and completer:
-                if middleware:
-                    completer = middleware(completer)
-                args = completer(current)
-                print(' '.join(args), end=' ')
 
-        print(' '.join((o for o in options if o.startswith(current))))
+def completion_cache():
+    '''Load completion cache from disk.
+
+    Entries are kept in order they were stored in, reading them does not
+    change it.
+    '''
+    import json
+    try:
+        with open(completion_path()) as f:
+            items = json.load(f)
+    except (IOError, ValueError):
+        items = []
+    return OrderedDict((k, (t, v)) for k, t, v in items)
 
-    sys.exit(1)
+
+def store_completion(key, results):
+    '''Put completer results in the cache, dropping the oldest entries.'''
+    import json
+    cache = completion_cache()
+    cache.pop(key, None)
+    cache[key] = (time.time(), list(results))
+    while len(cache) > COMPLETION_CACHE_SIZE:
+        cache.popitem(last=False)
+    items = [(k, t, v) for k, (t, v) in cache.items()]
+    atomic_write(completion_path(), json.dumps(items))
+
+
+# time (in seconds) after which lock of a refresh which has not finished is
+# taken over
+COMPLETION_REFRESH_TIMEOUT = 60
+
+
+def refresh_completion(completer, key, current):
+    '''Refresh cached results of a completer in background, unless they are
+    being refreshed already.'''
+    lock = refresh_lock(key)
+    if lock:
+        background(refresh_entry, completer, key, current, lock)
+
+
+def refresh_entry(completer, key, current, lock):
+    try:
+        store_completion(key, completer(current))
+    finally:
+        try:
+            os.unlink(lock)
+        except OSError:
+            pass
+
+
+def refresh_lock(key):
+    '''Create lock file for refreshing cache entry ``key``.
+
+    Returns its path, or None if the entry is being refreshed already.
+    '''
+    import hashlib
+    path = completion_path()
+    digest = hashlib.sha1(os.fsencode(path + ' ' + key)).hexdigest()
+    lock = os.path.join(os.path.dirname(path), digest + '.lock')
+    try:
+        if time.time() - os.stat(lock).st_mtime < COMPLETION_REFRESH_TIMEOUT:
+            return None
+        os.unlink(lock)  # left by a refresh which has died
+    except OSError:
+        pass
+    try:
+        os.makedirs(os.path.dirname(lock), exist_ok=True)
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except OSError:
+        return None
+    return lock
+
+
+def collect(completer, current, deadline):
+    '''Gather completer results for at most ``deadline`` seconds.
+
+    Returns list of results and a flag if completer has finished.
+    '''
+    import threading
+    results = []
+    failure = []
+
+    def run():
+        try:
+            results.extend(completer(current))
+        except Exception:
+            failure.append(sys.exc_info()[1])
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    thread.join(deadline)
+    if failure:
+        raise failure[0]
+    return list(results), not thread.is_alive()
+
+
+def background(func, *args):
+    '''Run a function in background.
+
+    Completion process exits right after printing results, so there (on
+    posix) work is done in a detached grandchild, which does not have to be
+    waited for. Other processes (like interactive shell) use a thread.
+    '''
+    if 'OPSTER_AUTO_COMPLETE' not in os.environ or not hasattr(os, 'fork'):
+        import threading
+        thread = threading.Thread(target=func, args=args)
+        thread.daemon = True
+        return thread.start()
+
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    try:
+        if not os.fork():
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            func(*args)
+    finally:
+        os._exit(0)
 
 
 COMPLETIONS = {
@@ -1023,6 +3707,338 @@ def completion(type=('t', 'bash', 'Completion type (bash or zsh)'),
     print(COMPLETIONS[type].strip() % prog_name)
 
 
+# --------
+# Scheduler
+# --------
+
+class CronSpec(object):
+    '''Schedule in crontab format: ``minute hour day month weekday``.
+
+    Fields are ``*``, numbers (or names of months and weekdays), ranges,
+    lists and steps (``*/15``, ``1-5/2``). Command is due when both day and
+    weekday match, unless both are restricted: then either has to match.
+
+    >>> from datetime import datetime
+    >>> spec = CronSpec('*/20 9-17 * * mon-fri')
+    >>> spec.next(datetime(2024, 3, 1, 17, 45))
+    datetime.datetime(2024, 3, 4, 9, 0)
+    >>> CronSpec('@monthly').next(datetime(2024, 3, 1, 0, 0))
+    datetime.datetime(2024, 4, 1, 0, 0)
+    '''
+    ALIASES = {'@yearly': '0 0 1 1 *', '@annually': '0 0 1 1 *',
+               '@monthly': '0 0 1 * *', '@weekly': '0 0 * * 0',
+               '@daily': '0 0 * * *', '@midnight': '0 0 * * *',
+               '@hourly': '0 * * * *'}
+    NAMES = dict([(name, i) for i, name in enumerate(
+        'jan feb mar apr may jun jul aug sep oct nov dec'.split(), 1)] +
+        [(name, i) for i, name in enumerate(
+            'sun mon tue wed thu fri sat'.split())])
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, spec):
+        self.spec = spec
+        fields = self.ALIASES.get(spec, spec).split()
+        if len(fields) != 5:
+            raise OpsterError('invalid schedule: %s' % spec)
+        (self.minutes, self.hours, self.days, self.months,
+         weekdays) = [self.parse(field, low, high)
+                      for field, (low, high) in zip(fields, self.RANGES)]
+        self.weekdays = set(day % 7 for day in weekdays)
+        self.either = fields[2] != '*' and fields[4] != '*'
+        self.next(self.start())  # fails if schedule never matches
+
+    def parse(self, field, low, high):
+        values = set()
+        try:
+            for part in field.lower().split(','):
+                part, _, step = part.partition('/')
+                step = int(step or 1)
+                if part == '*':
+                    start, end = low, high
+                elif '-' in part:
+                    start, end = [self.value(v) for v in part.split('-', 1)]
+                else:
+                    start = self.value(part)
+                    end = step > 1 and high or start
+                if not low <= start <= end <= high or step < 1:
+                    raise ValueError(part)
+                values.update(range(start, end + 1, step))
+        except ValueError:
+            raise OpsterError('invalid schedule: %s' % self.spec)
+        return values
+
+    def value(self, word):
+        return self.NAMES[word] if word in self.NAMES else int(word)
+
+    @staticmethod
+    def start():
+        from datetime import datetime
+        return datetime.now().replace(second=0, microsecond=0)
+
+    def matches(self, t):
+        '''Check if command is due in a minute of datetime ``t``.'''
+        return (t.minute in self.minutes and t.hour in self.hours and
+                t.month in self.months and self.day_matches(t))
+
+    def day_matches(self, t):
+        day = t.day in self.days
+        weekday = t.isoweekday() % 7 in self.weekdays
+        return (day or weekday) if self.either else (day and weekday)
+
+    def next(self, after):
+        '''First minute after datetime ``after`` when command is due.'''
+        from datetime import timedelta
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # 29th of February is on every weekday in 28 years
+        limit = t + timedelta(days=366 * 29)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) +
+                     timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise OpsterError('schedule never matches: %s' % self.spec)
+
+
+class Job(object):
+    '''Command line run on a schedule, see ``Dispatcher.schedule``.'''
+
+    def __init__(self, spec, argv, concurrency=1, jitter=0, name=None):
+        self.spec = spec
+        self.argv = argv
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.name = name or ' '.join(argv)
+        self.running = 0
+        self.due = None
+
+
+def crontab_jobs(fname, scriptname):
+    '''Jobs from lines of a crontab file, see ``Dispatcher.run_scheduler``.
+    '''
+    import shlex
+    jobs = []
+    with open(fname) as f:
+        for lineno, line in enumerate(f, 1):
+            words = line.split()
+            # skip comments and environment settings
+            if (not words or words[0].startswith('#') or
+                    re.match(r'\w+=', words[0])):
+                continue
+            size = words[0].startswith('@') and 1 or 5
+            try:
+                spec = CronSpec(' '.join(words[:size]))
+                argv = shlex.split(line.split(None, size)[-1], comments=True)
+            except (OpsterError, ValueError) as e:
+                raise OpsterError('%s:%d: %s' % (fname, lineno, e))
+            jobs.append(Job(spec, strip_program(argv, scriptname)))
+    return jobs
+
+
+class Scheduler(object):
+    '''Runs jobs when they are due, in a pool of threads.'''
+
+    def __init__(self, dispatcher, jobs, workers, log):
+        import threading
+        self.dispatcher = dispatcher
+        self.jobs = jobs
+        self.workers = workers
+        self.log = log
+        self.lock = threading.RLock()
+
+    def run(self, once=False):
+        from concurrent.futures import ThreadPoolExecutor
+        from datetime import datetime
+        with ThreadPoolExecutor(self.workers) as pool:
+            now = CronSpec.start()
+            if once:
+                for job in self.jobs:
+                    if job.spec.matches(now):
+                        self.start(pool, job, now)
+                return
+            for job in self.jobs:
+                job.due = job.spec.next(now)
+            try:
+                while True:
+                    due = min(job.due for job in self.jobs)
+                    delay = (due - datetime.now()).total_seconds()
+                    if delay > 0:
+                        # clock can be changed while sleeping
+                        time.sleep(min(delay, 60))
+                        continue
+                    for job in self.jobs:
+                        if job.due <= due:
+                            self.start(pool, job, job.due)
+                            # runs missed by a suspended process are skipped
+                            job.due = job.spec.next(max(due, datetime.now()))
+            except KeyboardInterrupt:
+                pass
+
+    def start(self, pool, job, due):
+        with self.lock:
+            if job.running >= job.concurrency:
+                return self.record(job, due, status='skipped')
+            job.running += 1
+        pool.submit(self.execute, job, due)
+
+    def execute(self, job, due):
+        try:
+            if job.jitter:
+                import random
+                time.sleep(random.uniform(0, job.jitter))
+            from datetime import datetime
+            started = datetime.now()
+            start = time.perf_counter()
+            result = self.dispatcher.invoke(job.argv)
+            self.record(job, due, status='done',
+                        started=started.isoformat(),
+                        seconds=round(time.perf_counter() - start, 3),
+                        code=result.code,
+                        stdout=result.stdout.decode('utf-8', 'replace'),
+                        stderr=result.stderr.decode('utf-8', 'replace'))
+        finally:
+            with self.lock:
+                job.running -= 1
+
+    def record(self, job, due, **fields):
+        import json
+        record = OrderedDict([('job', job.name), ('due', due.isoformat())])
+        record.update(fields)
+        with self.lock:
+            self.log.write(json.dumps(record) + '\n')
+            self.log.flush()
+
+
+# --------
+# Bundling
+# --------
+
+# launcher placed in bundle: looks up bundled modules directly in archive
+# instead of scanning sys.path and calls dispatch() of the target
+BUNDLE_MAIN = '''\
+import sys, zipimport
+MODULES = %(modules)r
+importer = zipimport.zipimporter(sys.path[0])
+class Finder(object):
+    @staticmethod
+    def find_spec(name, path=None, target=None):
+        if name in MODULES:
+            return importer.find_spec(name)
+sys.meta_path.insert(0, Finder)
+from %(module)s import %(attr)s as target
+sys.exit(target.dispatch() if hasattr(target, 'dispatch')
+         else target.command())
+'''
+
+
+def bundle_files(modules):
+    '''Map archive names of modules (whole packages for dotted names) to
+    their source files'''
+    import importlib.util
+    files = {}
+    for name in modules:
+        spec = importlib.util.find_spec(name.split('.')[0])
+        if spec is None or not (spec.origin or '').endswith('.py'):
+            raise OpsterError('Cannot bundle module %s' % name)
+        if not spec.submodule_search_locations:
+            files[os.path.basename(spec.origin)] = spec.origin
+            continue
+        base = os.path.dirname(os.path.dirname(spec.origin))
+        for root, dirs, names in os.walk(os.path.dirname(spec.origin)):
+            dirs[:] = [d for d in dirs if d != '__pycache__']
+            for fname in names:
+                if fname.endswith('.py'):
+                    path = os.path.join(root, fname)
+                    files[os.path.relpath(path, base)] = path
+    return files
+
+
+def compile_pyc(path):
+    '''Compile source file to contents of sourceless ``.pyc`` file'''
+    import importlib.util, marshal
+    with open(path, 'rb') as f:
+        source = f.read()
+    code = compile(source, path, 'exec', dont_inherit=True, optimize=0)
+    header = importlib.util.MAGIC_NUMBER + b'\0' * 12
+    return header + marshal.dumps(code)
+
+
+def bundle(target, output, modules=(), python=None):
+    '''Write ``target`` (``module:attr`` with Dispatcher or command) with
+    ``modules`` and opster itself into executable zip file ``output``
+
+    Modules are stored as bytecode only and launcher is run with ``-I -S``
+    so that neither ``site`` nor ``sys.path`` are consulted on startup.
+    '''
+    import zipfile
+    module, _, attr = target.partition(':')
+    if not attr:
+        raise OpsterError('Target should look like module:attr, got %s'
+                          % target)
+    files = bundle_files((module,) + tuple(modules))
+    files['opster.py'] = os.path.abspath(__file__)
+    names = {}
+    for arcname in files:
+        name = arcname[:-len('.py')].replace(os.sep, '.')
+        names[name[:-len('.__init__')] if name.endswith('.__init__')
+              else name] = True
+    with open(output, 'wb') as f:
+        f.write(b'#!' + (python or sys.executable).encode('utf-8') +
+                b' -IS\n')
+        with zipfile.ZipFile(f, 'w') as z:
+            z.writestr('__main__.py', BUNDLE_MAIN % {
+                'modules': sorted(names), 'module': module, 'attr': attr})
+            for arcname, path in sorted(files.items()):
+                z.writestr(arcname.replace(os.sep, '/') + 'c',
+                           compile_pyc(path))
+    os.chmod(output, os.stat(output).st_mode | 0o111)
+    return output
+
+
+def startup_time(argv, runs, env=None):
+    '''Mean wall time (in ms) of running ``argv`` ``runs`` times'''
+    import subprocess
+    start = time.perf_counter()
+    for i in range(runs):
+        if subprocess.call(argv, env=env, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL):
+            raise QuitError('%s failed to run' % argv[0])
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def bundle_command(target,
+                   output=('o', '', 'file to write (default: MODULE.pyz)'),
+                   include=('i', [], 'additional modules to bundle'),
+                   python=('p', '', 'interpreter to run bundle with'),
+                   compare=('c', 0, 'compare startup time of bundle and '
+                            'regular import over N runs')):
+    '''Bundle program into single executable file
+
+    TARGET is ``module:attr`` naming Dispatcher or command to run.
+    '''
+    output = output or target.partition(':')[0] + '.pyz'
+    bundle(target, output, include, python or None)
+    write('%s written' % output)
+    if compare:
+        module, _, attr = target.partition(':')
+        regular = [python or sys.executable, '-c',
+                   'import sys; from %s import %s as t; sys.exit('
+                   't.dispatch() if hasattr(t, "dispatch") else t.command())'
+                   % (module, attr), '--help']
+        # make sure this opster is importable like an installed one
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [os.path.dirname(os.path.abspath(__file__))] + sys.path))
+        bundled = [os.path.abspath(output), '--help']
+        write('regular: %.1fms' % startup_time(regular, compare, env))
+        write('bundled: %.1fms' % startup_time(bundled, compare))
+
+
 # --------
 # Exceptions
 # --------
@@ -1054,7 +4070,15 @@ class ErrorHandled(OpsterError):
 # API to expose QuitError for opster users
 command.Error = QuitError
 
+if os.environ.get('OPSTER_IMPORTS'):
+    ImportRecorder.install(os.environ['OPSTER_IMPORTS'], PRELOADED)
+
 
 if __name__ == '__main__':
-    import doctest
-    doctest.testmod()
+    if sys.argv[1:]:
+        tools = Dispatcher()
+        tools.command(name='bundle')(bundle_command)
+        sys.exit(tools.dispatch())
+    else:
+        import doctest
+        doctest.testmod()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+from enum import Enum
+from typing import Literal
+
+from opster import command, opt
+
+
+class Color(Enum):
+    red = 1
+    green = 2
+
+
+@command()
+def paint(name,
+          port: int = opt('p', 8000, 'port to listen on'),
+          ids: list[int] = opt('i', [], 'ids to paint'),
+          mode: Literal['fast', 'safe'] = opt('m', 'fast', 'painting mode'),
+          color: Color = opt('c', Color.red, 'color of paint'),
+          verbose: bool = opt('v', False, 'be verbose'),
+          defs: dict = opt('d', {}, 'definitions'),
+          size: tuple = ('s', ('small', 'big'), 'size of brush')):
+    '''Paint things, with types taken from annotations'''
+    print('%s %r %r %r %r %r' % (name, port, ids, mode, color, verbose))
+    print('%r %r' % (defs, size))
+
+
+if __name__ == '__main__':
+    paint.command()
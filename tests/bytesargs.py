@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+from opster import command
+
+
+@command(bytes_args=True)
+def main(prefix=('p', b'', 'prefix to strip from paths'),
+         label=('l', 'paths', 'label to print'),
+         *paths):
+    '''Print paths exactly as they were given'''
+    print(label)
+    for path in paths:
+        print(repr(path[len(prefix):] if path.startswith(prefix) else path))
+
+
+if __name__ == '__main__':
+    main.command()
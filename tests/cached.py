@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import sys
+
+from opster import command, ResultCache
+
+
+@command(cache=ResultCache(inputs=['config'], cache_failures=True))
+def report(name, config=('c', '', 'configuration file')):
+    '''Generate a report'''
+    print('generating report', file=sys.stderr)
+    print('report for', name)
+    if config:
+        with open(config) as f:
+            print(f.read().strip())
+    return 3
+
+
+if __name__ == '__main__':
+    sys.exit(report.command())
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+import sys
+
+from opster import command
+
+
+@command(cache=True)
+def lines(count):
+    '''Print a number of lines'''
+    print('computing', file=sys.stderr)
+    count = int(count)
+    if count < 0:
+        return 2
+    return (str(i) for i in range(count))
+
+
+if __name__ == '__main__':
+    sys.exit(lines.command())
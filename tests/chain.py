@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+from opster import Dispatcher
+
+d = Dispatcher(chain='+')
+
+
+@d.command()
+def numbers(count=('c', 5, 'how many numbers to generate')):
+    '''Generate some numbers'''
+    for i in range(count):
+        print('generating', i)
+        yield i
+
+
+@d.command()
+def evens(numbers):
+    '''Filter out odd numbers'''
+    return (n for n in numbers if n % 2 == 0)
+
+
+@d.command()
+def show(items, prefix=('p', '', 'prefix for every item')):
+    '''Print received items'''
+    for item in items:
+        print(prefix + str(item))
+
+
+if __name__ == '__main__':
+    d.dispatch()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import sys
+import time
+
+from opster import command, dispatch, cached_completer
+
+
+@cached_completer(ttl=3600)
+def branches(prefix):
+    print('looking for branches', file=sys.stderr)
+    return [b for b in ('main', 'maint', 'master', 'stable')
+            if b.startswith(prefix)]
+
+
+@cached_completer(ttl=3600, deadline=0.2)
+def tags(prefix):
+    for tag in ('v1.0', 'v1.1'):
+        yield tag
+    time.sleep(1)
+    yield 'v2.0'
+
+
+@command()
+def checkout(branch=('b', '', 'branch to check out', branches),
+             tag=('t', '', 'tag to check out', tags)):
+    '''Check out a branch or a tag'''
+    print(branch or tag)
+
+
+if __name__ == '__main__':
+    dispatch()
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+
+from opster import command, File
+
+
+@command()
+def main(source=('i', File('-', 'rb', mmap=True), 'file to read'),
+         target=('o', File('-', 'w'), 'file to write'),
+         fail=('f', False, 'fail after writing')):
+    '''Count lines in a file'''
+    data = source.view()
+    target.write('%s: %d lines\n' % (source, bytes(data).count(b'\n')))
+    if fail:
+        raise command.Error('failed')
+
+
+if __name__ == '__main__':
+    main.command()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+from opster import Dispatcher
+
+d = Dispatcher()
+
+RESOURCES = ['resource%d' % i for i in range(5000)]
+
+
+def getter(resource):
+    def get(id, fields=('f', [], 'fields to show')):
+        print('%s %s %s' % (resource, id, ' '.join(fields)))
+    get.__doc__ = 'Get an item of %s' % resource
+    return get
+
+
+d.register_many(('get-' + resource, getter(resource))
+                for resource in RESOURCES)
+
+
+def broken():
+    '''Command with a broken option'''
+
+
+# options are checked only when command is used
+d.register_many({'~broken': (broken, [('xx', 'long', False, 'help')], None)})
+
+
+if __name__ == '__main__':
+    d.dispatch()
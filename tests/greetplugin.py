@@ -0,0 +1,22 @@
+from __future__ import print_function
+
+import sys
+
+from opster import Dispatcher
+
+print('importing greetplugin', file=sys.stderr)
+
+d = Dispatcher()
+nested = Dispatcher()
+
+
+@d.command()
+def hello(name=('n', 'world', 'whom to greet')):
+    '''Say hello'''
+    print('hello', name)
+
+
+@nested.command()
+def bye(name=('n', 'world', 'whom to say goodbye')):
+    '''Say goodbye'''
+    print('bye', name)
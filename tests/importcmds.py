@@ -0,0 +1,8 @@
+'''Command which imports its dependency at module level'''
+
+import colorsys
+
+
+def render(color=('c', 0.5, 'hue of a color')):
+    '''Render a color'''
+    print(colorsys.hsv_to_rgb(float(color), 1, 1))
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+from opster import Dispatcher
+
+import importcmds
+
+d = Dispatcher()
+d.command()(importcmds.render)
+
+
+@d.command()
+def lazy():
+    '''Import dependency only when it is needed'''
+    import csv
+    print(csv.QUOTE_ALL)
+
+
+if __name__ == '__main__':
+    d.dispatch()
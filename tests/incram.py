@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+'''Run cram transcripts with example scripts executed inside of the runner.
+
+Commands of transcripts are run by a shell, like prysk does it, but lines of
+form ``[VAR=value ...] run script.py args`` are executed in the runner
+process: the shell only expands arguments and reports environment and
+current directory, and the script is run with ``runpy`` with its output
+captured. This saves starting an interpreter and importing opster for every
+command. Output is compared with transcripts the same way prysk compares it.
+
+Commands which need a process of their own (pipes, redirections, variables
+read by opster on import, scripts which fork or write to file descriptors)
+are left to the shell.
+'''
+
+import atexit, io, os, re, runpy, shutil, subprocess, sys, tempfile
+import importlib, traceback
+
+
+def pythonpath(env):
+    return [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p]
+
+
+# path of a script run by python, without script's directory and PYTHONPATH
+BASE_PATH = [p for p in sys.path[1:] if p not in pythonpath(os.environ)]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import opster
+from opster import command
+from prysk.diff import esc, glob, regex, unified_diff
+from prysk.test import _escape_utf8
+
+# commands opster defines for itself, like _completion
+OPSTER_COMMANDS = dict(opster._dispatcher._cmdtable)
+
+
+# scripts which fork, start threads, use terminal or spawn subprocesses
+SUBPROCESS = {'completers.py', 'watching.py', 'progressing.py',
+              'sampled.py', 'imports.py'}
+# environment variables read when opster is imported
+IMPORT_TIME_VARS = ('OPSTER_ARG_ENCODING', 'OPSTER_COMPLETION_CACHE_SIZE',
+                    'OPSTER_COMPLETION_DEADLINE', 'OPSTER_SAMPLE_INTERVAL',
+                    'OPSTER_IMPORTS', 'OPSTER_SAMPLE', 'COVERAGE')
+INPROCESS = re.compile(r'((?:\w+=\S* +)*)run +(\S+)((?: +[^|;&<>`()\n]*)?)')
+INDENT = b'  '
+
+
+class Shell(object):
+    '''Shell reading commands one by one, with their output and status.'''
+
+    def __init__(self, shell, env, cwd):
+        self.salt = b'INCRAM%d' % os.getpid()
+        self.proc = subprocess.Popen([shell, '-'], stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT, env=env,
+                                     cwd=cwd)
+
+    def run(self, cmd):
+        '''Run command, return its output and exit status.'''
+        self.proc.stdin.write(cmd + b"printf '\\n%s %%d\\n' $?\n" % self.salt)
+        self.proc.stdin.flush()
+        output = []
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                return b''.join(output), 255
+            if line.startswith(self.salt + b' '):
+                # the last newline was printed before salt
+                return b''.join(output)[:-1], int(line.split()[1])
+            output.append(line)
+
+    def query(self, assigns, words):
+        '''Expanded words, environment and current directory for a command.
+        '''
+        out, status = self.run(b"printf '%%s\\0' %s; printf '\\0\\n'; "
+                               b"%s env -0; printf '\\0\\n'; pwd\n"
+                               % (words, assigns))
+        words, env, cwd = out.split(b'\0\n')
+        words = [os.fsdecode(w) for w in words.split(b'\0')[:-1]]
+        env = dict(os.fsdecode(item).split('=', 1)
+                   for item in env.split(b'\0') if item)
+        return words, env, os.fsdecode(cwd.strip())
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+class Captured(object):
+    '''Process state (arguments, environment, streams) for a script run.'''
+
+    def __init__(self, path, argv, env, cwd):
+        self.path, self.argv, self.env, self.cwd = path, argv, env, cwd
+        self.buffer = io.BytesIO()
+        self.exitfuncs = []
+
+    def __enter__(self):
+        self.saved = (sys.argv, sys.path[:], dict(os.environ), os.getcwd(),
+                      sys.stdin, sys.stdout, sys.stderr, set(sys.modules),
+                      atexit.register, atexit.unregister)
+        sys.argv = [self.path] + self.argv
+        # site module makes entries of PYTHONPATH absolute
+        sys.path[:] = ([os.path.dirname(self.path)] +
+                       [os.path.abspath(p) for p in pythonpath(self.env)] +
+                       BASE_PATH)
+        os.environ.clear()
+        os.environ.update(self.env)
+        os.chdir(self.cwd)
+        importlib.invalidate_caches()
+        # scripts can replace streams, but these must not be closed before
+        # output is taken
+        self.streams = (
+            io.TextIOWrapper(io.BytesIO(), encoding='utf-8'),
+            io.TextIOWrapper(self.buffer, encoding='utf-8',
+                             write_through=True),
+            io.TextIOWrapper(self.buffer, encoding='utf-8',
+                             errors='backslashreplace', write_through=True))
+        sys.stdin, sys.stdout, sys.stderr = self.streams
+        atexit.register = self.register
+        atexit.unregister = self.unregister
+        opster._dispatcher = opster.Dispatcher(OPSTER_COMMANDS)
+        return self
+
+    def register(self, func, *args, **kwargs):
+        self.exitfuncs.append((func, args, kwargs))
+        return func
+
+    def unregister(self, func):
+        self.exitfuncs = [f for f in self.exitfuncs if f[0] != func]
+
+    def exit(self):
+        while self.exitfuncs:
+            func, args, kwargs = self.exitfuncs.pop()
+            func(*args, **kwargs)
+
+    def __exit__(self, *exc):
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except ValueError:
+                pass
+        output = self.buffer.getvalue()
+        for stream in self.streams:
+            stream.detach()
+        (sys.argv, sys.path[:], environ, cwd, sys.stdin, sys.stdout,
+         sys.stderr, modules, atexit.register, atexit.unregister) = self.saved
+        os.environ.clear()
+        os.environ.update(environ)
+        os.chdir(cwd)
+        # modules of examples are imported again by the next command
+        for name in set(sys.modules) - modules:
+            path = getattr(sys.modules[name], '__file__', None) or ''
+            if not path.startswith(sys.prefix):
+                del sys.modules[name]
+        self.output = output
+
+
+def run_script(path, argv, env, cwd):
+    '''Run script like python would do it, return its output and status.'''
+    with Captured(path, argv, env, cwd) as captured:
+        try:
+            try:
+                runpy.run_path(path, run_name='__main__')
+            finally:
+                captured.exit()
+            status = 0
+        except SystemExit as e:
+            status = exit_status(e.code)
+        except BaseException as e:
+            tb = e.__traceback__
+            while tb and tb.tb_frame.f_code.co_filename != path:
+                tb = tb.tb_next
+            traceback.print_exception(type(e), e, tb)
+            status = 1
+    return captured.output, status
+
+
+def exit_status(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code & 0xff
+    sys.stderr.write('%s\n' % code)
+    return 1
+
+
+def inprocess(cmd, shell):
+    '''Arguments for ``run_script`` if command can be run in process.'''
+    cmd = cmd.decode('utf-8', 'replace').rstrip('\n')
+    # stderr is captured together with stdout anyway
+    match = INPROCESS.fullmatch(cmd.replace(' 2>&1', ''))
+    if not match or '$(' in cmd:
+        return None
+    assigns, name, args = match.groups()
+    if os.path.basename(name) in SUBPROCESS:
+        return None
+    words, env, cwd = shell.query(assigns.encode('utf-8'),
+                                  ('"$TESTDIR"/' + name + args).encode('utf-8'))
+    opsterdir = os.path.dirname(opster.__file__)
+    if any(env.get(var) != os.environ.get(var) for var in IMPORT_TIME_VARS):
+        return None
+    if not any(os.path.abspath(p) == opsterdir for p in pythonpath(env)):
+        return None
+    return os.path.abspath(words[0]), words[1:], env, cwd
+
+
+def parse(lines):
+    '''Split transcript into commands, like prysk does it.
+
+    Returns lines of transcript, list of ``(line number, command)`` and
+    map of line numbers of commands to lines which follow their output.
+    '''
+    cmdline, conline = INDENT + b'$ ', INDENT + b'> '
+    after, refout, commands = {}, [], []
+    pos = prepos = -1
+    for i, line in enumerate(lines):
+        if not line.endswith(b'\n'):
+            line += b'\n'
+        refout.append(line)
+        if line.startswith(cmdline):
+            after.setdefault(pos, []).append(line)
+            prepos, pos = pos, i
+            commands.append((i, line[len(cmdline):]))
+        elif line.startswith(conline):
+            after.setdefault(prepos, []).append(line)
+            i, cmd = commands[-1]
+            commands[-1] = i, cmd + line[len(conline):]
+        elif not line.startswith(INDENT):
+            after.setdefault(pos, []).append(line)
+    return refout, commands, after
+
+
+def format_output(out, tmpdir):
+    '''Lines of output as they're written to transcript.'''
+    lines = []
+    for line in out.splitlines(True):
+        if line.endswith(b'\n'):
+            line = line[:-1]
+        else:
+            line += b' (no-eol)'
+        line = _escape_utf8(line)
+        line = re.sub(re.escape(tmpdir.encode()), b'$TMPDIR', line)
+        lines.append(INDENT + line + b'\n')
+    return lines
+
+
+def run_transcript(args):
+    '''Run transcript, return its name, diff and numbers of commands run in
+    process and by shell.'''
+    path, tmpdir, subprocesses = args
+    path = os.path.abspath(path)
+    testdir = os.path.join(tmpdir, os.path.basename(path))
+    os.mkdir(testdir)
+    env = dict(os.environ, TESTDIR=os.path.dirname(path),
+               TESTFILE=os.path.basename(path), TESTSHELL='/bin/sh',
+               PRYSK_TEMP=tmpdir)
+    for name in ('TMPDIR', 'TEMP', 'TMP'):
+        env[name] = os.path.join(tmpdir, 'tmp')
+
+    with open(path, 'rb') as f:
+        refout, commands, after = parse(f.readlines())
+    shell = Shell('/bin/sh', env, testdir)
+    postout = after.pop(-1, [])
+    counts = [0, 0]
+    try:
+        for pos, cmd in commands:
+            script = not subprocesses and inprocess(cmd, shell)
+            if script:
+                out, status = run_script(*script)
+            else:
+                out, status = shell.run(cmd)
+            counts[not script] += 1
+            postout.extend(format_output(out, env['TMPDIR']))
+            if status:
+                postout.append(INDENT + b'[%d]\n' % status)
+            postout.extend(after.pop(pos, []))
+    finally:
+        shell.close()
+
+    name = os.path.relpath(path).encode()
+    diff = list(unified_diff(refout, postout, name, name + b'.err',
+                             matchers=[esc, glob, regex]))
+    return path, diff, counts
+
+
+@command(usage='[OPTIONS] TRANSCRIPT...')
+def main(*transcripts,
+         jobs=('j', 1, 'number of transcripts to run in parallel'),
+         subprocesses=('s', False, 'run every command in a subprocess')):
+    '''Run cram transcripts, executing example scripts in process'''
+    tmpdir = tempfile.mkdtemp(prefix='incram-')
+    os.mkdir(os.path.join(tmpdir, 'tmp'))
+    tasks = [(t, tmpdir, subprocesses) for t in transcripts]
+    try:
+        if jobs > 1:
+            import multiprocessing
+            with multiprocessing.Pool(jobs) as pool:
+                results = pool.map(run_transcript, tasks)
+        else:
+            results = [run_transcript(task) for task in tasks]
+    finally:
+        shutil.rmtree(tmpdir)
+
+    failed = 0
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    for path, diff, counts in results:
+        out.write(b'!\n' if diff else b'.')
+        out.write(b''.join(diff))
+        failed += bool(diff)
+    out.flush()
+    inproc = sum(counts[0] for path, diff, counts in results)
+    shelled = sum(counts[1] for path, diff, counts in results)
+    print('\n# Ran %d tests, 0 skipped, %d failed (%d commands in process, '
+          '%d by shell).' % (len(results), failed, inproc, shelled))
+    return failed and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main.command())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import os, sys, threading, time
+
+from opster import Dispatcher, File, progress
+
+d = Dispatcher()
+models = []
+
+
+@d.resource('model')
+def model():
+    time.sleep(0.05)
+    models.append(len(models))
+    return models[-1]
+
+
+@d.command()
+def greet(name, greeting=('g', 'hello', 'greeting to use')):
+    '''Greet someone'''
+    print('%s %s from %s' % (greeting, name, os.environ.get('PLACE', '?')))
+    return len(name)
+
+
+@d.command()
+def upper():
+    '''Make stdin uppercase'''
+    for line in sys.stdin:
+        sys.stdout.write(line.upper())
+
+
+@d.command()
+def fail():
+    '''Raise an exception'''
+    raise ValueError('broken')
+
+
+@d.command()
+def big(size):
+    '''Write many bytes'''
+    sys.stdout.write('x' * int(size))
+
+
+@d.command()
+def copy(input=('i', File(), 'file to read'),
+         delay=('d', 0.0, 'seconds to wait between reads')):
+    '''Read a file slowly'''
+    chunks = []
+    while True:
+        chunk = input.read(10)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        time.sleep(delay)
+    print(len(''.join(chunks)))
+
+
+@d.command()
+def predict(*, model):
+    '''Use a shared model'''
+    print(model)
+
+
+@d.command()
+def work():
+    '''Report progress of slow work'''
+    for i in progress(range(5), label='work', interval=0.01):
+        time.sleep(0.02)
+
+
+def show(result):
+    for field in ('code', 'stdout', 'stderr', 'command', 'args', 'options',
+                  'result', 'exception'):
+        value = getattr(result, field)
+        if field == 'stderr' and value:
+            value = value.rstrip().splitlines()[-1]
+        print('%s: %r' % (field, value))
+
+
+@d.command()
+def main():
+    '''Show results of invocations'''
+    show(d.invoke(['greet', '-g', 'hi', 'world'], env={'PLACE': 'here'}))
+    print('PLACE' in os.environ)
+    show(d.invoke(['upper'], stdin=b'one\ntwo\n'))
+    show(d.invoke(['greet', '--bad']))
+    show(d.invoke(['fail']))
+    print(len(d.invoke(['big', '100000'], spool_size=1000).stdout))
+
+    results = {}
+
+    def run(i):
+        results[i] = d.invoke(['greet', str(i)]).stdout
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(all(results[i] == b'hello %d from ?\n' % i for i in range(20)))
+
+    # files opened by one invocation are not closed by another one
+    with open('data.txt', 'w') as f:
+        f.write('x' * 105)
+    copies = {}
+
+    def copy(delay):
+        copies[delay] = d.invoke(['copy', '-i', 'data.txt', '-d', delay])
+    threads = [threading.Thread(target=copy, args=(delay,))
+               for delay in ('0.01', '0.03')]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.03)
+    for thread in threads:
+        thread.join()
+    print(sorted(result.stdout for result in copies.values()))
+
+    # resources are created once for all threads
+    predictions = {}
+
+    def predict(i):
+        predictions[i] = d.invoke(['predict']).stdout
+    threads = [threading.Thread(target=predict, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(set(predictions.values()), models)
+
+    # progress is drawn by a thread, but belongs to the invocation
+    lines = d.invoke(['work']).stderr.splitlines()
+    print(len(lines) > 1, lines[-1].startswith(b'work: 5/5'))
+
+
+if __name__ == '__main__':
+    d.dispatch()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+import os
+
+from opster import command
+
+
+def load_config(path):
+    print('loading config')
+    path = path or os.environ.get('CONFIG', 'default.cfg')
+    if not path.endswith('.cfg'):
+        raise ValueError(path)
+    return path
+load_config.label = 'default.cfg'
+
+
+@command()
+def main(show=('s', False, 'show configuration'),
+         config=('c', load_config, 'configuration file')):
+    '''Show configuration when asked to'''
+    if show:
+        print('config: %s' % config)
+
+
+if __name__ == '__main__':
+    main.command()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+from opster import Dispatcher
+
+
+class Log(object):
+    def before(self, name, args, kwargs):
+        print('before', name, kwargs)
+
+    def after(self, name, result):
+        print('after', name, result)
+        return result
+
+    def error(self, name, exc):
+        print('error', name, repr(exc))
+
+
+def loud(func):
+    def inner(*args, **kwargs):
+        return func(*args, **kwargs).upper()
+    return inner
+
+
+d = Dispatcher()
+sub = Dispatcher()
+
+
+@d.command()
+def hello(name=('n', 'world', 'whom to greet')):
+    '''Greet somebody'''
+    return 'hello %s' % name
+
+
+@d.command()
+def fail():
+    '''Fail miserably'''
+    raise ValueError('oops')
+
+
+@sub.command()
+def shout(word):
+    '''Return a word'''
+    return word
+
+
+d.nest('sub', sub, 'Nested commands')
+d.use(Log())
+d.use(loud, commands=['hello', 'sub'])
+
+
+if __name__ == '__main__':
+    try:
+        print(d.dispatch())
+    except ValueError:
+        pass
@@ -169,6 +169,295 @@ simple as an argument to the --name option::
    nodoc   (no help text available)
    simple  Just simple command to print keys of received arguments.
 
+Commands can be chained, then each of them gets result of the previous one,
+which is consumed lazily::
+
+  $ run chain.py numbers -c 4 + evens + show -p '- '
+  generating 0
+  - 0
+  generating 1
+  generating 2
+  - 2
+  generating 3
+
+  $ run chain.py numbers + bad
+  unknown command: 'bad'
+
+Commands returning iterators have their output streamed, in a format of your
+choice::
+
+  $ run stream.py users -c 2
+  {'id': 0, 'name': 'user0'}
+  {'id': 1, 'name': 'user1'}
+  $ run stream.py users -c 2 --format jsonl
+  {"id": 0, "name": "user0"}
+  {"id": 1, "name": "user1"}
+  $ run stream.py --format=csv users -c 2
+  id,name
+  0,user0
+  1,user1
+
+Columns of csv output are taken from the first item, missing values are empty
+and other keys are left out::
+
+  $ run stream.py --format=csv events
+  id,name
+  0,start
+  1,
+  2,stop
+
+And it's fine to stop reading them early::
+
+  $ run stream.py users -c 1000000 | head -n 1
+  {'id': 0, 'name': 'user0'}
+
+Dispatcher can have a stack of middlewares, which can be limited to some of
+the commands (or nested dispatchers)::
+
+  $ run middlewares.py hello -n you
+  before hello {'name': 'you'}
+  after hello HELLO YOU
+  HELLO YOU
+  $ run middlewares.py fail
+  before fail {}
+  error fail ValueError('oops')
+  $ run middlewares.py sub shout hey
+  HEY
+
+Commands can be run from an interactive shell, paying startup time only once
+(and internal commands like ``_shell`` have to be typed in full, so ``comp``
+means ``complex`` here)::
+
+  $ printf 'simple\ncomp --pass\n\nbad\n' | run multicommands.py _shell
+  ['test', 'ui']
+  unknown command: 'bad'
+
+Resources (like connections) are created when a command needs them for the
+first time and are shared by all commands running in the same process::
+
+  $ run resources.py plain
+  no resources
+  $ printf 'users\nfetch users -v\nfetch users\n' | run resources.py _shell
+  connecting to db
+  alice
+  bob
+  opening session
+  fetching users with session
+  2
+  2
+  closing session
+  disconnecting from db
+
+Command lines (for example from crontab) can be checked without running
+them::
+
+  $ cat > crontab <<EOF
+  > # maintenance
+  > 0 * * * * subcmds.py cmd subcmd1 --quiet
+  > 5 * * * * subcmds.py cmd subcmd9
+  > cmd subcmd1 extra
+  > cmd2 --loud
+  > cmd "unbalanced
+  > help cmd
+  > EOF
+  $ run subcmds.py _check crontab
+  crontab:3: unknown command: 'subcmd9'
+  crontab:4: invalid arguments: multiple values for argument 'quiet'
+  crontab:5: option --loud not recognized
+  crontab:6: No closing quotation
+  $ printf 'users\nfetch\nfetch a b\nfetch a -v\n' | run resources.py _check
+  -:2: invalid arguments: missing a required argument: 'table'
+  -:3: invalid arguments: too many positional arguments
+
+Generated commands can be registered in bulk, they're introspected only when
+used::
+
+  $ run generated.py get-resource42 7 -f name -f size
+  resource42 7 name size
+  $ run generated.py help get-resource4999
+  generated.py get-resource4999 [OPTIONS] ID
+  
+  Get an item of resource4999
+  
+  options:
+  
+   -f --fields  fields to show
+   -h --help    display help
+  $ run generated.py help | tail -2
+   get-resource999   Get an item of resource999
+   help              Show help for a given help topic or a help overview.
+  $ run generated.py broken
+  Short option should be only a single character: xx
+
+Command lines can be run in process, with output captured::
+
+  $ run invoking.py main
+  code: 5
+  stdout: b'hi world from here\n'
+  stderr: b''
+  command: 'greet'
+  args: ['world']
+  options: {'greeting': 'hi'}
+  result: 5
+  exception: None
+  False
+  code: 0
+  stdout: b'ONE\nTWO\n'
+  stderr: b''
+  command: 'upper'
+  args: []
+  options: {}
+  result: None
+  exception: None
+  code: 255
+  stdout: b'invoking.py greet [OPTIONS] NAME\n\nGreet someone\n\noptions:\n\n -g --greeting  greeting to use (default: hello)\n -h --help      display help\n'
+  stderr: b'error: option --bad not recognized'
+  command: None
+  args: None
+  options: None
+  result: None
+  exception: GetoptError('option --bad not recognized', 'bad')
+  code: 1
+  stdout: b''
+  stderr: b'ValueError: broken'
+  command: 'fail'
+  args: []
+  options: {}
+  result: None
+  exception: ValueError('broken')
+  100000
+  True
+  [b'105\n', b'105\n']
+  {b'0\n'} [0]
+  True True
+
+Command lines given as strings can be parsed without running them, results of
+repeated lines are cached::
+
+  $ run parsing.py main
+  deploy ['svc'] [('env', 'prod'), ('help', False), ('tags', ('a', 'b'))]
+  cached: True
+  normalized: True
+  deploy ['my svc'] [('env', 'staging'), ('help', False), ('tags', ())]
+  cached: True
+  release ['svc'] [('help', False), ('version', (1, 2))]
+  cached: False
+  services restart ['web'] [('force', True), ('help', False)]
+  cached: True
+  GetoptError: option --bad not recognized
+  UnknownCommand: nothing
+  'mappingproxy' object does not support item assignment
+
+Commands can be searched by words in their names, help and options, including
+commands of nested dispatchers::
+
+  $ run parsing.py help -k serv
+  commands matching 'serv':
+  
+   deploy            Deploy a service
+   services          Manage services
+   services restart  Restart a service
+  $ run parsing.py help -k 'restart immediately'
+  commands matching 'restart immediately':
+  
+   services restart  Restart a service
+  $ run parsing.py help -k tag
+  commands matching 'tag':
+  
+   deploy  Deploy a service
+  $ run parsing.py help -k nothing
+  no commands matching 'nothing'
+
+Scheduled commands are run by ``_scheduler`` command in one process, every run
+is recorded::
+
+  $ run scheduled.py _scheduler --once --log runs.jsonl
+  $ "$PYTHON" -c 'import json, sys; [print(r["job"], r["status"], r["code"], repr(r["stdout"])) for r in map(json.loads, open("runs.jsonl"))]' | sort
+  greet world done 0 'hello world\n'
+  nap done 3 ''
+  $ printf 'SHELL=/bin/sh\n* * * * * python3 scheduled.py greet -g hi cron\n@yearly scheduled.py nosuch\n*/5 * * * * scheduled.py greet\n' > crontab
+  $ run scheduled.py _scheduler crontab
+  nosuch: unknown command: 'nosuch'
+  greet: invalid arguments: missing a required argument: 'name'
+  $ printf '0 0 30 2 * scheduled.py greet x\n' > crontab
+  $ run scheduled.py _scheduler crontab
+  crontab:1: schedule never matches: 0 0 30 2 *
+
+Time and memory spent on imports can be reported to find out what slows down
+start of a program, and which commands are imported on every start::
+
+  $ OPSTER_IMPORTS=- run imports.py lazy 2> imports.log
+  1
+  $ grep -v '^    [a-z_.]*$' imports.log
+  imports (cumulative time, memory):
+  startup:
+    opster +\d+\.\dms, -?[\d.]+[kMG]?B (re)
+    importcmds +\d+\.\dms, -?[\d.]+[kMG]?B (re)
+      colorsys +\d+\.\dms, -?[\d.]+[kMG]?B (re)
+  command lazy:
+    csv +\d+\.\dms, -?[\d.]+[kMG]?B (re)
+      _csv +\d+\.\dms, -?[\d.]+[kMG]?B (re)
+
+Modules imported by opster itself are listed under it::
+
+  $ grep -E '^    (bisect|contextvars|getopt|inspect|textwrap)$' imports.log
+      bisect
+      contextvars
+      getopt
+      inspect
+      textwrap
+  $ run imports.py _imports
+  render: importcmds imported at startup \(\d+\.\dms, -?[\d.]+[kMG]?B\): colorsys (re)
+
+Commands can come from plugins, installed as separate packages with entry
+points. Plugins are imported only when they're executed, plugin index is made
+from metadata of packages and help shows their summaries::
+
+  $ mkdir -p site/greetings-1.0.dist-info
+  $ printf 'Name: greetings\nVersion: 1.0\nSummary: Greeting commands\n' > site/greetings-1.0.dist-info/METADATA
+  $ printf '[opster_tests.commands]\nhello = greetplugin:hello\ngreetings = greetplugin:nested\nbroken = nosuchplugin:cmd\n' > site/greetings-1.0.dist-info/entry_points.txt
+  $ export PYTHONPATH="$PYTHONPATH:$PWD/site"
+  $ run plugins.py help
+  usage: plugins.py <command> [options]
+  
+  commands:
+  
+   broken     Greeting commands
+   greetings  Greeting commands
+   hello      Greeting commands
+   help       Show help for a given help topic or a help overview.
+   local      Command defined in the program itself
+  $ run plugins.py hello -n you
+  importing greetplugin
+  hello you
+  $ run plugins.py greetings bye
+  importing greetplugin
+  bye world
+  $ run plugins.py broken
+  cannot load plugin nosuchplugin:cmd: No module named 'nosuchplugin'
+
+Program can be bundled with opster into single executable file::
+
+  $ PYTHONPATH="$PYTHONPATH:$TESTDIR" "$PYTHON" "$TESTDIR/../opster.py" bundle subcmds:d
+  subcmds.pyz written
+  $ ./subcmds.pyz help cmd
+  usage: subcmds.pyz cmd <command> [options]
+  
+  commands:
+  
+   subcmd1  Help for subcmd1
+   subcmd2  Help for subcmd2
+   subcmd3  Help for subcmd3
+  $ PYTHONPATH="$PYTHONPATH:$TESTDIR" "$PYTHON" "$TESTDIR/../opster.py" bundle nomodule:main
+  Cannot bundle module nomodule
+  [255]
+  $ PYTHONPATH="$PYTHONPATH:$TESTDIR" "$PYTHON" "$TESTDIR/../opster.py" bundle hello:hello -o hi.pyz -c 2
+  hi.pyz written
+  regular: \d+\.\dms (re)
+  bundled: \d+\.\dms (re)
+  $ ./hi.pyz world
+  Hello world
+
 We also have completion::
 
   $ run multicommands.py _completion
@@ -182,6 +471,127 @@ We also have completion::
   complete -o default -F _opster_completion multicommands.py
   # opster bash completion end
 
+Option completers can be cached, so that slow ones are not called on every
+key press::
+
+  $ export OPSTER_CACHE_DIR="$PWD/cache"
+  $ completions() {
+  >   COMP_WORDS="$*" COMP_CWORD=$(( $# - 1 )) OPSTER_AUTO_COMPLETE=1 run "$@"
+  > }
+  $ completions completers.py checkout -b ma
+  looking for branches
+  main maint master
+  [1]
+  $ completions completers.py checkout -b ma
+  main maint master
+  [1]
+
+Every program has its own cache::
+
+  $ cp "$TESTDIR/completers.py" branches.py
+  $ COMP_WORDS="branches.py checkout -b ma" COMP_CWORD=3 \
+  > OPSTER_AUTO_COMPLETE=1 "$PYTHON" branches.py checkout -b ma
+  looking for branches
+  main maint master
+  [1]
+
+Completion knows about nested commands, options which were already given and
+``--option=value`` syntax::
+
+  $ completions subcmds.py cmd subcmd3 subsubcmd --
+  --help --loud --showhelp
+  [1]
+  $ completions subcmds.py cmd subcmd1 -q -
+  --help --showhelp -h
+  [1]
+  $ completions stream.py users --format=j
+  --format=jsonl
+  [1]
+
+Completer which is too slow gives what it has found before the deadline::
+
+  $ completions completers.py checkout --tag v
+  v1.0 v1.1
+  [1]
+
+Stale results are refreshed once at a time, in a thread of a long running
+process (like the shell)::
+
+  $ "$PYTHON" -c 'import os, time, opster
+  > calls = []
+  > def slow(prefix):
+  >     calls.append(prefix)
+  >     time.sleep(0.2)
+  >     return ["x%d" % len(calls)]
+  > slow.ttl = 0.01
+  > for i in range(3):
+  >     print(opster.run_completer(slow, "stale", ""))
+  >     time.sleep(0.05)
+  > time.sleep(0.3)
+  > print(len(calls), opster.run_completer(slow, "stale", ""))
+  > try:
+  >     os.waitpid(-1, os.WNOHANG)
+  > except ChildProcessError:
+  >     print("no child processes")'
+  ['x1']
+  ['x1']
+  ['x1']
+  2 ['x2']
+  no child processes
+
+Types of options can be declared with annotations::
+
+  $ run annotated.py x
+  x 8000 [] 'fast' <Color.red: 1> False
+  {} 'small'
+  $ run annotated.py x -p 80 -i 1 -i 2 -m safe -c green -v -d a=1 -s big
+  x 80 [1, 2] 'safe' <Color.green: 2> True
+  {'a': '1'} 'big'
+  $ run annotated.py x -m slow 2>&1 | head -1
+  error: unrecognised value: 'slow' (should be one of fast, safe)
+  $ run annotated.py x -i one 2>&1 | head -1
+  error: invalid option value ['one'] for option 'ids'
+  $ run annotated.py --help
+  annotated.py [OPTIONS] NAME
+  
+  Paint things, with types taken from annotations
+  
+  options:
+  
+   -p --port     port to listen on (default: 8000)
+   -i --ids      ids to paint
+   -m --mode     painting mode (default: fast)
+   -c --color    color of paint (default: red)
+   -v --verbose  be verbose
+   -d --defs     definitions
+   -s --size     size of brush (default: small)
+   -h --help     display help
+
+Annotations which cannot be used to convert values are reported::
+
+  $ "$PYTHON" -c 'from opster import command, opt
+  > @command()
+  > def f(port: int | None = opt("p", None, "port")): pass' 2>&1 | tail -1
+  opster.OpsterError: Unsupported annotation of option port: int | None
+
+Plain option tuples are not typed by annotations, and annotations which cannot
+be resolved are left alone::
+
+  $ cat > plain.py <<EOF
+  > from __future__ import annotations
+  > from typing import TYPE_CHECKING
+  > from opster import command, opt
+  > if TYPE_CHECKING:
+  >     from decimal import Decimal
+  > @command()
+  > def main(amount: Decimal = None, port: str = ('p', 8000, 'port'),
+  >          level: Decimal = opt('l', 1, 'level')):
+  >     print(repr(amount), repr(port), repr(level))
+  > main.command()
+  > EOF
+  $ "$PYTHON" plain.py -p 80 -l 2
+  None 80 2
+
 
 Now we're going to test if a script with a single command will work (not
 everyone needs subcommands, you know)::
@@ -310,6 +720,140 @@ Lets try some extended option types::
   money: <class 'decimal.Decimal'> -0.12
   ratio: <class 'fractions.Fraction'> 5/6
 
+Files can be options too, ``-`` means standard input or output::
+
+  $ printf 'a\nb\n' | run files.py
+  -: 2 lines
+  $ printf 'a\nb\nc\n' > data
+  $ run files.py -i data -o out
+  $ cat out
+  data: 3 lines
+
+Written files get mode of files they replace, new files get usual mode::
+
+  $ (umask 027; run files.py -i data -o new)
+  $ stat -c %a new
+  640
+  $ chmod 604 new
+  $ run files.py -i data -o new
+  $ stat -c %a new
+  604
+
+Output files are written only if command succeeds::
+
+  $ run files.py -i data -o out2 --fail
+  failed
+  $ ls out*
+  out
+
+Results of commands, which depend only on their arguments and input files,
+can be cached::
+
+  $ echo one > conf
+  $ run cached.py x -c conf
+  generating report
+  report for x
+  one
+  [3]
+  $ run cached.py x -c conf
+  report for x
+  one
+  [3]
+  $ echo three > conf
+  $ run cached.py x -c conf
+  generating report
+  report for x
+  three
+  [3]
+
+Results are kept apart for every program, and are not used after a program is
+changed::
+
+  $ cp "$TESTDIR/cached.py" other.py
+  $ "$PYTHON" other.py x -c conf
+  generating report
+  report for x
+  three
+  [3]
+  $ "$PYTHON" other.py x -c conf
+  report for x
+  three
+  [3]
+  $ touch -d '+1 minute' other.py
+  $ "$PYTHON" other.py x -c conf
+  generating report
+  report for x
+  three
+  [3]
+
+Only successful runs are cached, unless ``cache_failures`` is set, and output
+cut off by a closed pipe is not cached::
+
+  $ run cachedlines.py -- -1
+  computing
+  [2]
+  $ run cachedlines.py -- -1
+  computing
+  [2]
+  $ run cachedlines.py 100000 | head -n 2
+  computing
+  0
+  1
+  $ run cachedlines.py 100000 | wc -l
+  computing
+  \s*100000 (re)
+  $ run cachedlines.py 100000 | wc -l
+  \s*100000 (re)
+
+With ``--watch`` command is run again when its input files change (until it's
+interrupted)::
+
+  $ echo one > input
+  $ (sleep 0.7; echo two > input) &
+  $ timeout -s INT 2 "$PYTHON" "$TESTDIR/watching.py" build --watch -s input
+  building one
+  files changed, running build again
+  building two
+  [124]
+
+Changes made while the command is running make it run again::
+
+  $ echo one > input
+  $ (sleep 0.3; echo two > input) &
+  $ timeout -s INT 2 "$PYTHON" "$TESTDIR/watching.py" build --watch -s input --slow 0.6
+  building one
+  files changed, running build again
+  building two
+  [124]
+
+Output files are not watched, even in a watched directory, and command without
+files to watch is run once::
+
+  $ mkdir rendering && cd rendering
+  $ echo one > input
+  $ (sleep 0.7; echo two > input) &
+  $ timeout -s INT 2 "$PYTHON" "$TESTDIR/watching.py" render --watch -s input -o out
+  rendering one
+  files changed, running render again
+  rendering two
+  [124]
+  $ cat out
+  two
+  $ cd ..
+  $ "$PYTHON" "$TESTDIR/watching.py" clean --watch
+  clean has no files to watch, running it once
+  cleaning
+
+Commands can report their progress; when output is not a terminal, report is
+written as a separate line from time to time::
+
+  $ run progressing.py -c 3
+  item 0
+  item 1
+  item 2
+  processing: 3/3 \(100%\) \d+\.\ds (re)
+  3 \d+\.\ds (re)
+
 Another things should be checked: calling help display from the function
 itself::
 
@@ -365,6 +909,14 @@ And there is no problems handling unicode data::
   $ OPSTER_ARG_ENCODING=utf-8 run hello.py кросавчег -g Привет
   \xd0\x9f\xd1\x80\xd0\xb8\xd0\xb2\xd0\xb5\xd1\x82 \xd0\xba\xd1\x80\xd0\xbe\xd1\x81\xd0\xb0\xd0\xb2\xd1\x87\xd0\xb5\xd0\xb3 (esc)
 
+Commands dealing with a lot of paths can get arguments as bytes, exactly as
+they were given::
+
+  $ run bytesargs.py -p /tmp/ /tmp/a "$(printf 'b\377')" -l files
+  files
+  b'a'
+  b'b\xff'
+
 
 .. _multivalues:
 
@@ -682,7 +1234,7 @@ that we can have subsubcommands.
    subsubcmd  Help for subsubcmd
 
   $ run subcmds.py help cmd subcmd3 --help
-  subcmds.py help [TOPIC]
+  subcmds.py help [OPTIONS] [TOPIC]
   
   Show help for a given help topic or a help overview.
   
@@ -690,9 +1242,12 @@ that we can have subsubcommands.
   
           Given a command name, print help for that command.
   
+          With -k, list commands which have a word in their names or help.
+  
   options:
   
-   -h --help  display help
+   -k --keyword  list commands with words in their names or help
+   -h --help     display help
 
   $ run subcmds.py help cmd subcmd3 subsubcmd
   subcmds.py cmd subcmd3 subsubcmd [OPTIONS]
@@ -774,6 +1329,47 @@ Check the `varargs` works when calling ```main``` directly::
   music: True
 
 
+Stacks of a command can be sampled to find where it spends time::
+
+  $ OPSTER_SAMPLE=out.folded OPSTER_SAMPLE_INTERVAL=0.001 run sampled.py -s 0.1
+  $ grep 'spin (sampled.py' out.folded | sed 's/ [0-9]*$//'
+  <module> (sampled.py:1);[opster] inner;[opster] command;[opster] run;[opster] inner;spin (sampled.py:8)
+
+Function options are not converted unless the command uses their values,
+and help shows their ``label``::
+
+  $ run labels.py --help -c my.cfg
+  labels.py [OPTIONS]
+  
+  Show configuration when asked to
+  
+  options:
+  
+   -s --show    show configuration
+   -c --config  configuration file (default: default.cfg)
+   -h --help    display help
+  $ run labels.py
+  $ run labels.py --show
+  loading config
+  config: default.cfg
+  $ run labels.py --show -c my.cfg
+  loading config
+  config: my.cfg
+  $ run labels.py --show -c my.txt 2>&1 | head -2
+  loading config
+  error: invalid option value 'my.txt' for option 'config'
+  $ CONFIG=my.txt run labels.py --show 2>&1 | head -2
+  loading config
+  error: invalid default value for option 'config': my.txt
+
+The same goes for commands called from Python::
+
+  $ PYTHONPATH="$TESTDIR:$PYTHONPATH" "$PYTHON" -c 'from labels import main
+  > main()
+  > main(show=True)'
+  loading config
+  config: default.cfg
+
 Check that calling main directly still works even if ```arginfo.defaults``` is
 None::
 
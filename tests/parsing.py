@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import getopt
+
+from opster import Dispatcher, OpsterError
+
+d = Dispatcher()
+services = Dispatcher()
+d.nest('services', services, 'Manage services')
+
+
+@d.command()
+def deploy(service, env=('e', 'staging', 'environment'),
+           tags=('t', [], 'tags to add')):
+    '''Deploy a service'''
+
+
+def version(value):
+    return tuple(int(x) for x in (value or '0').split('.'))
+
+
+@d.command()
+def release(service, version=('v', version, 'version to release')):
+    '''Release a version'''
+
+
+@services.command()
+def restart(service, force=('f', False, 'restart immediately')):
+    '''Restart a service'''
+
+
+def show(line):
+    try:
+        parsed = d.parse_string(line)
+    except (OpsterError, getopt.GetoptError) as e:
+        print('%s: %s' % (type(e).__name__, e))
+        return
+    print('%s %s %s' % (parsed.command, list(parsed.args),
+                        sorted(parsed.options.items())))
+    print('cached: %s' % (d.parse_string(line) is parsed))
+
+
+@d.command()
+def main():
+    '''Show parsed lines'''
+    show('deploy --env prod svc -t a -t b')
+    spaced = d.parse_string('  deploy --env  prod svc -t a -t b')
+    print('normalized: %s' %
+          (spaced is d.parse_string('deploy --env prod svc -t a -t b')))
+    show("deploy 'my svc'")
+    show('release svc -v 1.2')
+    show('serv restart -f web')
+    show('deploy --bad svc')
+    show('nothing')
+    parsed = d.parse_string('deploy svc -t a')
+    try:
+        parsed.options['env'] = 'prod'
+    except TypeError as e:
+        print(e)
+
+
+if __name__ == '__main__':
+    d.dispatch()
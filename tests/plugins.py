@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+from opster import Dispatcher
+
+d = Dispatcher()
+
+
+@d.command()
+def local():
+    '''Command defined in the program itself'''
+    print('local')
+
+
+d.load_plugins('opster_tests.commands')
+
+if __name__ == '__main__':
+    d.dispatch()
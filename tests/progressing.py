@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+
+from opster import command, progress, write
+
+
+@command()
+def main(count=('c', 3, 'number of items to process')):
+    '''Process some items showing progress'''
+    for i in progress(range(count), label='processing'):
+        write('item %d' % i)
+    for i in progress(iter(range(count))):
+        pass
+
+
+if __name__ == '__main__':
+    main.command()
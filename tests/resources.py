@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+from opster import Dispatcher
+
+d = Dispatcher()
+
+
+@d.resource('db')
+def db():
+    print('connecting to db')
+    yield {'users': ['alice', 'bob']}
+    print('disconnecting from db')
+
+
+@d.resource('session')
+def session():
+    print('opening session')
+    yield 'session'
+    print('closing session')
+
+
+@d.command()
+def users(*, db):
+    '''List users'''
+    for user in db['users']:
+        print(user)
+
+
+@d.command()
+def fetch(table, *, db, session,
+          verbose=('v', False, 'be verbose')):
+    '''Fetch a table using session'''
+    if verbose:
+        print('fetching %s with %s' % (table, session))
+    print(len(db[table]))
+
+
+@d.command()
+def plain():
+    '''Command without resources'''
+    print('no resources')
+
+
+if __name__ == '__main__':
+    d.dispatch()
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+
+import time
+
+from opster import command
+
+
+@command()
+def spin(seconds=('s', 0.3, 'CPU time to burn')):
+    '''Burn CPU for a while'''
+    end = time.process_time() + float(seconds)
+    while time.process_time() < end:
+        pass
+
+
+if __name__ == '__main__':
+    spin.command()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+import time
+
+from opster import Dispatcher
+
+d = Dispatcher()
+
+
+@d.command()
+def greet(name, greeting=('g', 'hello', 'greeting to use')):
+    '''Greet someone'''
+    print('%s %s' % (greeting, name))
+
+
+@d.command()
+def slow(seconds):
+    '''Sleep for a while'''
+    time.sleep(float(seconds))
+    return 3
+
+
+d.schedule('* * * * *', ['greet', 'world'])
+d.schedule('* * * * *', 'slow 0.1', jitter=0.05, name='nap')
+
+
+if __name__ == '__main__':
+    d.dispatch()
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+
+from opster import Dispatcher
+
+d = Dispatcher(formats=True)
+
+
+@d.command()
+def users(count=('c', 3, 'number of users to list')):
+    '''List some users'''
+    for i in range(count):
+        yield {'id': i, 'name': 'user%d' % i}
+
+
+@d.command()
+def events():
+    '''List events, which have different fields'''
+    yield {'id': 0, 'name': 'start'}
+    yield {'id': 1, 'user': 'user1'}
+    yield {'id': 2, 'name': 'stop', 'user': 'user1'}
+
+
+if __name__ == '__main__':
+    d.dispatch()
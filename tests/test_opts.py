@@ -2,6 +2,11 @@ import pprint
 from opster import command
 
 
+def test_default(x):
+    return x or 'test'
+test_default.label = 'test'
+
+
 @command(usage='[-l HOST] DIR')
 def another(dirname,
             listen=('l', 'localhost', 'ip to listen on'),
@@ -9,7 +14,7 @@ def another(dirname,
             daemonize=('d', False, 'daemonize process'),
             pid_file=('', '', 'name of file to write process ID to'),
             definitions=('D', {}, 'just some definitions'),
-            test=('t', lambda x: x or 'test', 'testing help for a function')):
+            test=('t', test_default, 'testing help for a function')):
     '''Command with option declaration as keyword arguments
     '''
     pprint.pprint(locals())
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import time
+
+from opster import Dispatcher, File
+
+d = Dispatcher(watch=True)
+
+
+@d.command()
+def build(source=('s', File('-'), 'file to build'),
+          slow=('', 0.0, 'seconds to spend building')):
+    '''Build a file'''
+    print('building', source.read().strip())
+    time.sleep(slow)
+
+
+@d.command(watch=['.'])
+def render(source=('s', File('-'), 'file to render'),
+           target=('o', File('-', 'w'), 'file to write')):
+    '''Render a file'''
+    text = source.read().strip()
+    print('rendering', text)
+    target.write(text + '\n')
+
+
+@d.command()
+def clean():
+    '''Remove built files'''
+    print('cleaning')
+
+
+if __name__ == '__main__':
+    d.dispatch()